@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger("dataklinik")
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Limiter:
+    # Не больше limit операций одновременно и не больше max_waiting в очереди за ними.
+    # Сверх этого slot() сразу бросает Overloaded: вызывающий отвечает "подождите",
+    # а не копит очередь, которую всё равно не успеет обработать.
+    # parent — общий лимит, внутри которого этот (доля клиники): слот сначала берётся в доле,
+    # потом в общем лимите, поэтому одна клиника не займёт больше своей доли общей очереди.
+
+    def __init__(self, limit, max_waiting, parent=None):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.parent = parent
+        self.in_flight = 0
+        self.waiting = 0
+        self._sem = asyncio.Semaphore(limit)
+        self.stats = {"admitted": 0, "shed": 0, "max_waiting_seen": 0}
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._sem.locked() and self.waiting >= self.max_waiting:
+            self.stats["shed"] += 1
+            raise Overloaded()
+        self.waiting += 1
+        self.stats["max_waiting_seen"] = max(self.stats["max_waiting_seen"], self.waiting)
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.stats["admitted"] += 1
+        try:
+            if self.parent is None:
+                yield
+            else:
+                async with self.parent.slot():
+                    yield
+        finally:
+            self.in_flight -= 1
+            self._sem.release()
+
+    def metrics(self):
+        return dict(self.stats, in_flight=self.in_flight, waiting=self.waiting, limit=self.limit)
+
+
+class ChatAdmission:
+    # Очередь апдейтов по чатам. Первый апдейт чата обрабатывается сразу; всё, что приходит
+    # от этого чата, пока идёт ход, копится (не больше max_pending) и следующим ходом уходит
+    # в process одной пачкой — там сообщения можно склеить в один ход. Обработчик, который
+    # только положил апдейт в очередь, сразу завершается и не занимает слот Application.
+    # window > 0 — сколько подождать перед первым ходом, собирая сообщения, отправленные подряд.
+
+    def __init__(self, max_pending=5, window=0.0):
+        self.max_pending = max_pending
+        self.window = window
+        self._queues = {}   # chat_id -> апдейты, ждущие следующего хода
+        self.stats = {"updates": 0, "turns": 0, "coalesced": 0, "shed": 0}
+
+    async def submit(self, chat_id, item, process):
+        # False — очередь чата переполнена, апдейт не принят
+        self.stats["updates"] += 1
+        queue = self._queues.get(chat_id)
+        if queue is not None:
+            if len(queue) >= self.max_pending:
+                self.stats["shed"] += 1
+                return False
+            queue.append(item)
+            return True
+        queue = self._queues[chat_id] = [item]
+        try:
+            if self.window:
+                await asyncio.sleep(self.window)
+            while queue:
+                batch = list(queue)
+                queue.clear()
+                self.stats["turns"] += 1
+                try:
+                    await process(batch)
+                except Exception:
+                    logger.exception("Ошибка обработки апдейта чата %s", chat_id)
+        finally:
+            del self._queues[chat_id]
+        return True
+
+    @property
+    def queued(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def metrics(self):
+        return dict(self.stats, active_chats=len(self._queues), queued=self.queued,
+                    max_pending=self.max_pending)
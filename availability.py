@@ -0,0 +1,142 @@
+import time
+from datetime import datetime, timedelta
+
+from booking_store import normalize_date
+
+
+class AvailabilityEngine:
+    # Занятость слотов как битовые маски на (услуга, дата): бит i — i-й слот услуги из
+    # services.json. Маска занятых строится из BookingStore и пересчитывается только когда
+    # store изменился (store.version). Поверх неё — короткие брони (holds): слот, выбранный
+    # пациентом, не показывается другим, пока он не подтвердит запись или бронь не истечёт.
+
+    def __init__(self, store, services, hold_seconds=300):
+        self.store = store
+        self.hold_seconds = hold_seconds
+        self._slots = {}      # услуга.lower() -> [время, ...]
+        self._bits = {}       # услуга.lower() -> {время: номер бита}
+        self._taken = {}      # (услуга.lower(), дата) -> (store.version, маска)
+        self._holds = {}      # (услуга.lower(), дата) -> {бит: (holder, истекает)}
+        self.set_services(services)
+
+    def set_services(self, services):
+        slots = {s["название"].strip().lower(): list(s.get("слоты", [])) for s in services}
+        # Брони хранятся номерами битов: у услуг, чьи слоты изменились, они теряют смысл
+        for key in [k for k in self._holds if self._slots.get(k[0]) != slots.get(k[0])]:
+            del self._holds[key]
+        self._slots = slots
+        self._bits = {name: {t: i for i, t in enumerate(slots)} for name, slots in self._slots.items()}
+        self._taken.clear()
+
+    @staticmethod
+    def _key(service, date):
+        return service.strip().lower(), normalize_date(date)
+
+    def _taken_mask(self, key):
+        cached = self._taken.get(key)
+        if cached and cached[0] == self.store.version:
+            return cached[1]
+        bits = self._bits.get(key[0], {})
+        mask = 0
+        for t in self.store.taken_slots(*key):
+            if t in bits:
+                mask |= 1 << bits[t]
+        if len(self._taken) > 10000:
+            self._taken.clear()
+        self._taken[key] = (self.store.version, mask)
+        return mask
+
+    def _held_mask(self, key, holder):
+        holds = self._holds.get(key)
+        if not holds:
+            return 0
+        now = time.monotonic()
+        mask = 0
+        for bit, (who, expires) in list(holds.items()):
+            if expires < now:
+                del holds[bit]
+            elif who != holder:
+                mask |= 1 << bit
+        if not holds:
+            del self._holds[key]
+        return mask
+
+    def _past_mask(self, key, now):
+        # Сегодня уже прошедшие слоты недоступны
+        if key[1] != now.strftime("%d.%m.%Y"):
+            return 0
+        current = now.strftime("%H:%M")
+        mask = 0
+        for t, bit in self._bits.get(key[0], {}).items():
+            if t <= current:
+                mask |= 1 << bit
+        return mask
+
+    def busy_mask(self, service, date, holder=None, now=None):
+        key = self._key(service, date)
+        return (self._taken_mask(key) | self._held_mask(key, holder)
+                | self._past_mask(key, now or datetime.now()))
+
+    def free(self, service, date, holder=None):
+        # None — услуга неизвестна; [] — всё занято
+        slots = self._slots.get(service.strip().lower())
+        if slots is None:
+            return None
+        busy = self.busy_mask(service, date, holder)
+        return [t for i, t in enumerate(slots) if not busy >> i & 1]
+
+    def hold(self, service, date, slot, holder):
+        key = self._key(service, date)
+        bit = self._bits.get(key[0], {}).get(slot)
+        if bit is None or self.busy_mask(service, date, holder) >> bit & 1:
+            return False
+        # У пациента одновременно не больше одной брони
+        self.release(holder)
+        self._holds.setdefault(key, {})[bit] = (holder, time.monotonic() + self.hold_seconds)
+        return True
+
+    def release(self, holder):
+        for key in list(self._holds):
+            holds = self._holds[key]
+            for bit in [b for b, (who, _) in holds.items() if who == holder]:
+                del holds[bit]
+            if not holds:
+                del self._holds[key]
+
+    def reserve(self, service, date, slot, holder, current=None):
+        # Атомарная проверка перед записью: вызывать и сразу, без await, ставить запись в очередь.
+        # current — слот, который уже занят самим пациентом (при переносе записи)
+        if slot == current:
+            self.release(holder)
+            return True
+        key = self._key(service, date)
+        bit = self._bits.get(key[0], {}).get(slot)
+        if bit is None or self.busy_mask(service, date, holder) >> bit & 1:
+            return False
+        self.release(holder)
+        return True
+
+    def next_free(self, service, limit=5, days=7, start=None, holder=None):
+        # Ближайшие limit свободных слотов за days дней начиная с start: [(дата, время)]
+        slots = self._slots.get(service.strip().lower())
+        if not slots:
+            return []
+        now = datetime.now()
+        try:
+            day = max(now, datetime.strptime(normalize_date(start), "%d.%m.%Y")) if start else now
+        except ValueError:
+            day = now
+        result = []
+        for _ in range(days):
+            date = day.strftime("%d.%m.%Y")
+            busy = self.busy_mask(service, date, holder, now)
+            for i, t in enumerate(slots):
+                if not busy >> i & 1:
+                    result.append((date, t))
+                    if len(result) >= limit:
+                        return result
+            day += timedelta(days=1)
+        return result
+
+    def metrics(self):
+        return {"holds": sum(len(h) for h in self._holds.values()), "cached_masks": len(self._taken)}
@@ -0,0 +1,179 @@
+# Заглушки Telegram, Google Sheets и OpenAI для офлайн-бенчмарков.
+# import_main подменяет открытие листа на FakeSheet и кладёт все файлы состояния во временный каталог.
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+HEADER = ["Имя", "Телефон", "Услуга", "Дата", "Время", "Chat ID", "Создано"]
+
+
+class FakeSheet:
+    # gspread синхронный, поэтому задержка — блокирующий time.sleep
+    id = 0
+
+    def __init__(self, latency=0.0, rows=()):
+        self.latency = latency
+        self.rows = [list(HEADER)] + [list(r) for r in rows]
+        self.calls = Counter()
+        self.cells_read = 0
+        self.spreadsheet = SimpleNamespace(batch_update=self._spreadsheet_batch_update)
+
+    def _io(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_all_values(self):
+        self._io("get_all_values")
+        self.cells_read += sum(len(r) for r in self.rows)
+        return [list(r) for r in self.rows]
+
+    def get(self, range_name):
+        # Только диапазоны вида "A5:G" — от строки до конца листа
+        self._io("get")
+        start, end = range_name.split(":")
+        first, width = int(start[1:]), ord(end) - ord("A") + 1
+        rows = [list(r[:width]) for r in self.rows[first - 1:]]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        self.cells_read += sum(len(r) for r in rows)
+        return rows
+
+    def batch_get(self, ranges):
+        # Только диапазоны вида "A5:G5" — одна строка
+        self._io("batch_get")
+        result = []
+        for range_name in ranges:
+            start, end = range_name.split(":")
+            first, last, width = int(start[1:]), int(end[1:]), ord(end[0]) - ord("A") + 1
+            rows = [list(r[:width]) for r in self.rows[first - 1:last]]
+            self.cells_read += sum(len(r) for r in rows)
+            result.append(rows)
+        return result
+
+    def append_row(self, row):
+        self._io("append_row")
+        self.rows.append([str(v) for v in row])
+
+    def append_rows(self, rows):
+        self._io("append_rows")
+        self.rows.extend([str(v) for v in row] for row in rows)
+
+    def delete_row(self, idx):
+        self._io("delete_row")
+        self.rows.pop(idx - 1)
+
+    def update_cell(self, row, col, value):
+        self._io("update_cell")
+        self.rows[row - 1][col - 1] = str(value)
+
+    def batch_update(self, data):
+        self._io("batch_update")
+        for item in data:
+            col, row = item["range"][0], int(item["range"][1:])
+            self.rows[row - 1][ord(col) - ord("A")] = str(item["values"][0][0])
+
+    def _spreadsheet_batch_update(self, body):
+        self._io("spreadsheet.batch_update")
+        for req in body["requests"]:
+            self.rows.pop(req["deleteDimension"]["range"]["startIndex"])
+
+
+class FakeCompletions:
+    def __init__(self, latency=0.0, reply="Ответ"):
+        self.latency = latency
+        self.reply = reply
+        self.calls = 0
+
+    async def create(self, model, messages, stream=False, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        usage = SimpleNamespace(prompt_tokens=sum(len(m["content"]) // 4 for m in messages),
+                                completion_tokens=len(self.reply) // 4)
+        if not stream:
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=self.reply))], usage=usage)
+        return self._stream(usage)
+
+    async def _stream(self, usage):
+        for word in self.reply.split(" "):
+            delta = SimpleNamespace(content=word + " ")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        yield SimpleNamespace(choices=[], usage=usage)
+
+
+def fake_openai(latency=0.0, reply="Ответ"):
+    completions = FakeCompletions(latency, reply)
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions)), completions
+
+
+class FakeBot:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent = Counter()
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent[chat_id] += 1
+        await asyncio.sleep(self.latency)
+        return FakeMessage(text, self)
+
+
+class FakeMessage:
+    def __init__(self, text, bot=None):
+        self.text = text
+        self.bot = bot
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        if self.bot:
+            self.bot.sent["reply"] += 1
+            await asyncio.sleep(self.bot.latency)
+        return FakeMessage(text, self.bot)
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+        if self.bot:
+            self.bot.sent["edit"] += 1
+            await asyncio.sleep(self.bot.latency)
+
+
+class FakeApplication:
+    def drop_user_data(self, user_id):
+        pass
+
+
+def make_update(chat_id, text, bot=None):
+    return SimpleNamespace(
+        message=FakeMessage(text, bot),
+        effective_chat=SimpleNamespace(id=chat_id),
+        effective_user=SimpleNamespace(id=chat_id),
+    )
+
+
+def make_context(bot, clinic, user_data=None):
+    return SimpleNamespace(bot=bot, user_data={} if user_data is None else user_data,
+                           bot_data={"clinic": clinic}, application=FakeApplication())
+
+
+def import_main(sheet, env=None):
+    workdir = tempfile.mkdtemp(prefix="dataklinik-bench-")
+    os.environ.update({
+        "WRITE_JOURNAL_FILE": os.path.join(workdir, "write_journal.jsonl"),
+        "STATE_DB_FILE": os.path.join(workdir, "conversations.sqlite3"),
+        "REMINDERS_DB_FILE": os.path.join(workdir, "reminders.sqlite3"),
+        "NOTIFY_DB_FILE": os.path.join(workdir, "notifications.sqlite3"),
+    })
+    os.environ.setdefault("OPENAI_STREAM", "0")
+    os.environ.update(env or {})
+    os.chdir(ROOT)
+    import main
+    main.open_sheet = lambda url=None: sheet
+    return main
@@ -0,0 +1,119 @@
+# Офлайн-прогон сценариев диалога через handle_update без Telegram, OpenAI и Google:
+# консультация, полная запись, отмена и перенос. Печатает сообщения/сек, задержку по этапам
+# и число обращений к бэкендам на один диалог.
+# Запуск из корня репозитория:
+#   python bench/harness.py --conversations 200 --sheets-latency 0.2 --openai-latency 1.0
+import argparse
+import asyncio
+import statistics
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from fakes import FakeBot, FakeSheet, fake_openai, import_main, make_context, make_update
+
+TOMORROW = (datetime.now() + timedelta(days=1)).strftime("%d.%m.%Y")
+
+# (этап, текст сообщения)
+SCENARIOS = {
+    "consult": [
+        ("consult", "Здравствуйте, сколько стоит чистка зубов?"),
+        ("consult", "А чем Zoom отличается от обычного отбеливания?"),
+        ("consult", "Спасибо!"),
+    ],
+    "booking": [
+        ("consult", "Хочу записаться на рентген"),
+        ("reg_name", "Я Иван"),
+        ("reg_date", "завтра"),
+        ("reg_time", "1"),
+        ("reg_phone", "87001112233"),
+    ],
+    "booking_one_message": [
+        ("consult", "Запишите на чистку завтра в 10:30, Иван, 87001112233"),
+    ],
+    "cancel": [
+        ("cancel", "Хочу отменить запись"),
+    ],
+    "reschedule": [
+        ("reschedule", "Можно поменять время?"),
+        ("reschedule_pick", "2"),
+    ],
+}
+# Сценариям отмены и переноса нужна существующая запись в листе
+SEEDED = {"cancel", "reschedule"}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def seed_rows(plan):
+    return [["Пациент", "+77000000000", "Консультация врача", TOMORROW, "10:00", str(chat_id), "seed"]
+            for chat_id, name in plan if name in SEEDED]
+
+
+async def run_conversation(main, bot, chat_id, script, stages):
+    context = make_context(bot, main.clinics[0])
+    for stage, text in script:
+        start = time.perf_counter()
+        await main.handle_update(make_update(chat_id, text, bot), context)
+        stages[stage].append(time.perf_counter() - start)
+
+
+async def run(args):
+    names = [n for n in args.scenarios.split(",") if n]
+    plan = [(200000 + i, names[i % len(names)]) for i in range(args.conversations)]
+    sheet = FakeSheet(args.sheets_latency, seed_rows(plan))
+    startup = time.perf_counter()
+    main = import_main(sheet)
+    startup = time.perf_counter() - startup
+    main.openai, completions = fake_openai(args.openai_latency)
+    bot = FakeBot(args.telegram_latency)
+    clinic = main.clinics[0]
+    await clinic.wait_bookings()
+    sheet.calls.clear()
+
+    stages = defaultdict(list)
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def one(chat_id, name):
+        async with sem:
+            await run_conversation(main, bot, chat_id, SCENARIOS[name], stages)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(chat_id, name) for chat_id, name in plan))
+    elapsed = time.perf_counter() - start
+    flush_start = time.perf_counter()
+    while clinic.write_queue.pending:
+        await clinic.write_queue.flush()
+    flush = time.perf_counter() - flush_start
+
+    messages = sum(len(v) for v in stages.values())
+    n = len(plan)
+    print(f"conversations={n} messages={messages} concurrency={args.concurrency} import={startup:.2f}s")
+    print(f"elapsed={elapsed:.2f}s throughput={messages / elapsed:.1f} msg/s  final flush={flush:.2f}s")
+    print(f"{'stage':16s} {'count':>6s} {'p50 ms':>9s} {'p99 ms':>9s} {'mean ms':>9s}")
+    for stage, values in sorted(stages.items()):
+        print(f"{stage:16s} {len(values):6d} {percentile(values, 50) * 1000:9.2f} "
+              f"{percentile(values, 99) * 1000:9.2f} {statistics.mean(values) * 1000:9.2f}")
+    telegram = sum(bot.sent.values())
+    print("backend calls per conversation:")
+    print(f"  sheets   {sum(sheet.calls.values()) / n:6.2f}  {dict(sheet.calls)}")
+    print(f"  openai   {completions.calls / n:6.2f}")
+    print(f"  telegram {telegram / n:6.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="секунды на вызов gspread")
+    parser.add_argument("--openai-latency", type=float, default=0.0, help="секунды на ответ OpenAI")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="секунды на вызов Bot API")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# Нагрузочный тест handle_message на локальных заглушках Telegram, Sheets и OpenAI.
+# Запуск из корня репозитория:  python bench/load_test.py --users 200
+import argparse
+import asyncio
+import statistics
+import time
+
+from fakes import FakeBot, FakeSheet, fake_openai, import_main, make_context, make_update
+
+BOOKING_SCRIPT = ["Хочу записаться на рентген", "Я Иван", "завтра", "1", "87001112233"]
+CONSULT_SCRIPT = ["Сколько стоит отбеливание?", "А чистка?"]
+
+
+# --- Сценарий ---
+async def run_user(main, chat_id, script, latencies):
+    bot = FakeBot()
+    context = make_context(bot, main.clinics[0])
+    for text in script:
+        start = time.perf_counter()
+        await main.handle_message(make_update(chat_id, text, bot), context)
+        latencies.append(time.perf_counter() - start)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run(args):
+    sheet = FakeSheet(args.sheets_latency)
+    main = import_main(sheet)
+    main.openai, completions = fake_openai(args.openai_latency)
+
+    latencies = {"booking": [], "consult": []}
+    tasks = []
+    for i in range(args.users):
+        kind = "booking" if i % 2 else "consult"
+        script = BOOKING_SCRIPT if kind == "booking" else CONSULT_SCRIPT
+        tasks.append(run_user(main, 100000 + i, script, latencies[kind]))
+
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    total = latencies["booking"] + latencies["consult"]
+    print(f"users={args.users} messages={len(total)} elapsed={elapsed:.2f}s "
+          f"throughput={len(total) / elapsed:.1f} msg/s")
+    for name, values in [("all", total)] + sorted(latencies.items()):
+        print(f"{name:8s} p50={percentile(values, 50) * 1000:8.1f} ms  "
+              f"p99={percentile(values, 99) * 1000:8.1f} ms  "
+              f"mean={statistics.mean(values) * 1000:8.1f} ms")
+    await main.clinics[0].write_queue.flush()
+    print(f"sheets_calls={sum(sheet.calls.values())} openai_calls={completions.calls} "
+          f"consult_cache={main.consult_cache.metrics()}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--sheets-latency", type=float, default=0.3, help="секунды на вызов gspread")
+    parser.add_argument("--openai-latency", type=float, default=1.5, help="секунды на ответ OpenAI")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Микробенчмарк: линейный поиск услуги (как было в match_service) против ServiceMatcher.
+# На 21 услуге и 10 сообщениях скорость одинаковая (3 прогона: legacy 19–22 мкс, matcher
+# 20 мкс на сообщение). Выигрыш матчера — полный ранжированный список кандидатов вместо
+# первого совпадения, а не скорость.
+# Запуск из корня репозитория:  python bench/matcher_bench.py
+import json
+import os
+import re
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from service_matcher import ServiceMatcher  # noqa: E402
+
+MESSAGES = [
+    "Здравствуйте, хочу записаться на консультацию к врачу",
+    "Сколько стоит чистка зубов?",
+    "У ребёнка болит зуб, можно записать ребёнка на завтра?",
+    "нужно сделать снимок зуба, панорамный снимок делаете?",
+    "хочу отбелить зубы к свадьбе, сколько стоит отбеливание zoom",
+    "Добрый вечер! У меня выпала пломба, можно поставить пломбу?",
+    "болит внутри, кажется пульпит, нужно лечение каналов",
+    "запишите на чистку завтра в 10:30, Иван, 87001112233",
+    "какие есть услуги и цены?",
+    "спасибо, до свидания",
+]
+
+
+def legacy_match_service(services_dict, text):
+    services = list(services_dict.values())
+    q = text.lower()
+    m = re.match(r"\b(\d{1,2})\b", q)
+    if m:
+        idx = int(m.group(1)) - 1
+        if 0 <= idx < len(services):
+            return services[idx]["название"]
+    for key, s in services_dict.items():
+        if s["название"].lower() in q:
+            return s["название"]
+        for kw in s.get("ключи", []):
+            if kw.lower() in q:
+                return s["название"]
+    return None
+
+
+def main():
+    with open(os.path.join(ROOT, "services.json"), encoding="utf-8") as f:
+        services_dict = json.load(f)
+    matcher = ServiceMatcher(services_dict)
+    build = timeit.timeit(lambda: ServiceMatcher(services_dict), number=20) / 20
+
+    rounds = 2000
+    legacy = timeit.timeit(lambda: [legacy_match_service(services_dict, m) for m in MESSAGES], number=rounds)
+    indexed = timeit.timeit(lambda: [matcher.rank(m) for m in MESSAGES], number=rounds)
+    per_msg = rounds * len(MESSAGES)
+
+    print(f"services={len(services_dict)} messages={len(MESSAGES)} build={build * 1000:.2f} ms")
+    print(f"legacy   {legacy / per_msg * 1e6:8.2f} us/message (first hit only)")
+    print(f"matcher  {indexed / per_msg * 1e6:8.2f} us/message (full ranked list)")
+    print()
+    for m in MESSAGES:
+        print(f"{m!r}\n    legacy:  {legacy_match_service(services_dict, m)}\n    matcher: {matcher.rank(m)[:3]}")
+
+
+if __name__ == "__main__":
+    main()
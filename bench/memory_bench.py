@@ -0,0 +1,83 @@
+# Бенчмарк памяти консультанта: размер промпта на каждом ходе длинного диалога.
+#   legacy  — системный промпт + 10 последних сообщений пациента целиком (как было до бюджета токенов)
+#   full    — вся переписка с ответами бота, без ограничений
+#   memory  — ConversationMemory: реплики обеих сторон в бюджете + краткое содержание старых
+# Время ответа оценивается по модели "prefill_ms на 1000 токенов промпта" — реальный коэффициент
+# зависит от модели и нагрузки OpenAI, поэтому он параметр.
+# Запуск из корня репозитория:  python bench/memory_bench.py --turns 40
+import argparse
+import os
+import statistics
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from catalog import Catalog  # noqa: E402
+from conversation_memory import ConversationMemory  # noqa: E402
+from conversation_store import estimate_tokens  # noqa: E402
+
+SHORT = [
+    "Сколько стоит чистка зубов?",
+    "А отбеливание Zoom безопасно для эмали?",
+    "Можно ли прийти с ребёнком?",
+]
+LONG = [
+    "Здравствуйте! У меня уже неделю ноет зуб слева внизу, особенно когда пью холодное, "
+    "а вчера вечером заболело сильнее и отдаёт в ухо. Раньше там ставили пломбу, лет пять назад. "
+    "Подскажите, что это может быть, нужно ли делать снимок и сколько примерно будет стоить лечение? " * 2,
+]
+REPLY = (
+    "Понимаю ваше беспокойство. Такие симптомы часто связаны с воспалением под старой пломбой. "
+    "Рекомендуем начать с консультации врача и рентгена зуба — это позволит точно понять причину. "
+    "Консультация бесплатна, рентген стоит от 3000 ₸. Если понадобится лечение каналов, врач "
+    "заранее расскажет о стоимости и вариантах. " * 3
+)
+
+
+def prompt_tokens(messages):
+    return sum(estimate_tokens(m["content"]) for m in messages)
+
+
+def simulate(turns, messages, memory, system_prompt):
+    legacy, full, budgeted = [], [], []
+    user_only, everything, state = [], [], {}
+    for i in range(turns):
+        text = messages[i % len(messages)]
+        user_only.append({"role": "user", "content": text})
+        everything.append({"role": "user", "content": text})
+        memory.add(state, "user", text)
+        system = [{"role": "system", "content": system_prompt}]
+        legacy.append(prompt_tokens(system + user_only[-10:]))
+        full.append(prompt_tokens(system + everything))
+        budgeted.append(prompt_tokens(memory.prompt(state, system_prompt)))
+        everything.append({"role": "assistant", "content": REPLY})
+        memory.add(state, "assistant", REPLY)
+        if memory.needs_summary(state):
+            # Вместо модели — содержание предельного размера
+            memory.fold(state, memory.overflow(state), "х" * memory.summary_tokens * 4)
+    return legacy, full, budgeted
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--budget", type=int, default=1500)
+    parser.add_argument("--prefill-ms", type=float, default=40.0, help="мс на 1000 токенов промпта")
+    args = parser.parse_args()
+
+    system_prompt = Catalog.load(os.path.join(ROOT, "services.json")).system_prompt
+    print(f"turns={args.turns} budget={args.budget} system_prompt={estimate_tokens(system_prompt)} tokens "
+          f"prefill={args.prefill_ms:.0f} ms/1k tokens")
+    print(f"{'messages':9s} {'mode':7s} {'mean':>7s} {'last':>7s} {'max':>7s} {'total':>9s} {'~ms/turn':>9s}")
+    for name, messages in (("short", SHORT), ("long", LONG)):
+        memory = ConversationMemory(args.budget)
+        results = zip(("legacy", "full", "memory"), simulate(args.turns, messages, memory, system_prompt))
+        for mode, tokens in results:
+            print(f"{name:9s} {mode:7s} {statistics.mean(tokens):7.0f} {tokens[-1]:7d} {max(tokens):7d} "
+                  f"{sum(tokens):9d} {statistics.mean(tokens) * args.prefill_ms / 1000:9.1f}")
+        print(f"{'':9s} summaries={memory.stats['summaries']} folded_turns={memory.stats['folded_turns']}")
+
+
+if __name__ == "__main__":
+    main()
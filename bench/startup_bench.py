@@ -0,0 +1,76 @@
+# Бенчмарк холодного старта: время импорта main.py, время до первого ответа консультанта и
+# до первого ответа, которому нужны записи из листа. Каждый замер — в отдельном процессе.
+# Запуск из корня репозитория:  python bench/startup_bench.py --runs 5 --connect-latency 1.5
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from fakes import FakeBot, FakeSheet, fake_openai, import_main, make_context, make_update
+
+
+async def child(args):
+    sheet = FakeSheet(args.sheet_latency)
+    start = time.perf_counter()
+    main = import_main(sheet)
+    result = {"import": time.perf_counter() - start}
+
+    def slow_open(url=None):
+        # авторизация и open_by_url
+        time.sleep(args.connect_latency)
+        return sheet
+
+    main.open_sheet = slow_open
+    main.openai, _ = fake_openai(args.openai_latency)
+    bot = FakeBot()
+    clinic = main.clinics[0]
+    clinic.start_warmup()
+
+    start = time.perf_counter()
+    await main.handle_update(make_update(1, "Сколько стоит чистка?", bot), make_context(bot, clinic))
+    result["first_consult"] = time.perf_counter() - start
+    start = time.perf_counter()
+    await main.handle_update(make_update(2, "Хочу записаться на рентген", bot), make_context(bot, clinic))
+    result["first_booking"] = time.perf_counter() - start
+    result.update({f"phase:{k}": v for k, v in main.startup.phases.items()})
+    result.update({f"phase:{k}": v for k, v in clinic.startup.phases.items()})
+    print(json.dumps(result))
+
+
+def parent(args):
+    runs = []
+    for _ in range(args.runs):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child",
+             "--connect-latency", str(args.connect_latency),
+             "--sheet-latency", str(args.sheet_latency),
+             "--openai-latency", str(args.openai_latency)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    print(f"runs={args.runs} connect_latency={args.connect_latency}s sheet_latency={args.sheet_latency}s")
+    for key in runs[0]:
+        values = [r[key] for r in runs if key in r]
+        print(f"{key:28s} median={statistics.median(values) * 1000:8.1f} ms  max={max(values) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--connect-latency", type=float, default=1.5, help="секунды на авторизацию и open_by_url")
+    parser.add_argument("--sheet-latency", type=float, default=0.5, help="секунды на чтение листа")
+    parser.add_argument("--openai-latency", type=float, default=0.0)
+    parser.add_argument("--child", action="store_true")
+    args = parser.parse_args()
+    if args.child:
+        asyncio.run(child(args))
+    else:
+        parent(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Бенчмарк хранилища состояния диалогов: память на 1000 пользователей и восстановление после рестарта.
+# Запуск из корня репозитория:  python bench/state_bench.py --users 20000
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from conversation_store import ConversationStore, trim_history  # noqa: E402
+
+QUESTIONS = [
+    "Здравствуйте, сколько стоит чистка зубов и сколько она длится?",
+    "А отбеливание Zoom безопасно для эмали? Будет ли чувствительность после процедуры?",
+    "У ребёнка болит зуб, можно ли прийти сегодня вечером или лучше завтра утром?",
+]
+
+
+def make_state(i):
+    history = [{"role": "user", "content": QUESTIONS[k % len(QUESTIONS)] * 2} for k in range(10)]
+    return {
+        "state": "reg_time",
+        "form": {"Услуга": "Чистка зубов (проф. гигиена)", "Имя": f"Пациент{i}", "Дата": "18.10.2026"},
+        "free_slots": ["10:00", "10:30", "11:00", "11:30", "12:00", "12:30", "14:30"],
+        "history": history,
+    }
+
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, after - before
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--hot-size", type=int, default=1000)
+    parser.add_argument("--budget", type=int, default=300, help="бюджет токенов истории")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, "state.sqlite3")
+
+    _, raw_bytes = measure(lambda: {i: make_state(i) for i in range(args.users)})
+
+    def fill():
+        store = ConversationStore(path, hot_size=args.hot_size)
+        for i in range(args.users):
+            state = make_state(i)
+            state["history"] = trim_history(state["history"], args.budget)
+            store.put(i, state)
+        return store
+
+    start = time.perf_counter()
+    store, store_bytes = measure(fill)
+    fill_seconds = time.perf_counter() - start
+    store.close()
+    disk_bytes = os.path.getsize(path) + sum(
+        os.path.getsize(path + ext) for ext in ("-wal", "-shm") if os.path.exists(path + ext))
+
+    start = time.perf_counter()
+    store = ConversationStore(path, hot_size=args.hot_size)
+    reopen = time.perf_counter() - start
+    start = time.perf_counter()
+    first = store.get(args.users // 2)
+    first_get = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(args.users):
+        store.get(i)
+    all_get = time.perf_counter() - start
+    assert first["form"]["Имя"] == f"Пациент{args.users // 2}"
+
+    per_k = 1000 / args.users
+    print(f"users={args.users} hot_size={args.hot_size} history_budget={args.budget} tokens")
+    print(f"user_data in memory (10 raw messages): {raw_bytes * per_k / 1024:8.1f} KiB per 1k users")
+    print(f"ConversationStore hot set:             {store_bytes * per_k / 1024:8.1f} KiB per 1k users")
+    print(f"on disk:                               {disk_bytes * per_k / 1024:8.1f} KiB per 1k users")
+    print(f"write all states: {fill_seconds:.2f}s ({fill_seconds / args.users * 1e6:.0f} us/put)")
+    print(f"restart: reopen={reopen * 1000:.1f} ms first_get={first_get * 1000:.2f} ms "
+          f"all_get={all_get:.2f}s ({all_get / args.users * 1e6:.0f} us/get)")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
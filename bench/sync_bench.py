@@ -0,0 +1,78 @@
+# Бенчмарк синхронизации с листом: полное перечитывание (refresh) против дочитывания хвоста (sync)
+# на листах в 10k–100k строк. Между синхронизациями администратор дописывает --new-rows строк.
+# Запуск из корня репозитория:  python bench/sync_bench.py --rows 10000,50000,100000 --new-rows 10
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from fakes import FakeSheet
+
+from blocking_io import BlockingPool
+from booking_store import BookingStore
+from write_queue import SheetWriteQueue
+
+
+def make_row(i):
+    return [f"Пациент{i}", f"+7700{i:07d}", "Чистка зубов (проф. гигиена)",
+            f"{i % 28 + 1:02d}.{i % 12 + 1:02d}.2026", "10:00", str(100000 + i), "seed"]
+
+
+async def measure(rows, new_rows, rounds, workdir):
+    sheet = FakeSheet(rows=[make_row(i) for i in range(rows)])
+    store = BookingStore(sheet)
+    pool = BlockingPool(1, name="bench")
+    queue = SheetWriteQueue(sheet, store, pool, os.path.join(workdir, f"journal-{rows}.jsonl"))
+    await queue.refresh()
+
+    def grow():
+        start = len(sheet.rows)
+        sheet.rows.extend(make_row(start + i) for i in range(new_rows))
+
+    # Медианы: первый замер после большой загрузки иногда попадает на сборку мусора
+    full_times, full_cells = [], []
+    for _ in range(rounds):
+        grow()
+        sheet.cells_read = 0
+        start = time.perf_counter()
+        await queue.refresh()
+        full_times.append(time.perf_counter() - start)
+        full_cells.append(sheet.cells_read)
+
+    delta_times, delta_cells = [], []
+    for _ in range(rounds):
+        grow()
+        sheet.cells_read = 0
+        start = time.perf_counter()
+        added = await queue.sync()
+        delta_times.append(time.perf_counter() - start)
+        delta_cells.append(sheet.cells_read)
+        assert added == new_rows, added
+    assert len(store.records) == len(sheet.rows) - 1
+    pool.shutdown()
+    return (statistics.median(full_times), statistics.median(full_cells),
+            statistics.median(delta_times), statistics.median(delta_cells))
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="dataklinik-sync-")
+    print(f"new rows per sync={args.new_rows} rounds={args.rounds}")
+    print(f"{'rows':>8s} {'refresh ms':>11s} {'cells':>9s} {'sync ms':>9s} {'cells':>7s} {'speedup':>8s}")
+    for rows in (int(r) for r in args.rows.split(",")):
+        full_time, full_cells, delta_time, delta_cells = await measure(rows, args.new_rows, args.rounds, workdir)
+        print(f"{rows:8d} {full_time * 1000:11.1f} {full_cells:9.0f} {delta_time * 1000:9.2f} "
+              f"{delta_cells:7.0f} {full_time / delta_time:7.0f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", default="10000,50000,100000")
+    parser.add_argument("--new-rows", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=5)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+
+
+class BlockingPool:
+    # Ограниченный пул потоков для синхронных клиентов (gspread): вызовы не блокируют
+    # event loop, а число одновременных запросов к API не превышает max_workers.
+    # observe(op) — необязательный контекстный менеджер для замера каждого вызова.
+
+    def __init__(self, max_workers, name="io", observe=None):
+        self.max_workers = max_workers
+        self.name = name
+        self.observe = observe
+        self.in_flight = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        op = getattr(func, "__name__", "call")
+        self.in_flight += 1
+        try:
+            with self.observe(op) if self.observe else nullcontext():
+                return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+        finally:
+            self.in_flight -= 1
+
+    @property
+    def queued(self):
+        # Вызовы, ждущие свободного потока
+        return max(0, self.in_flight - self.max_workers)
+
+    def share(self, limit):
+        return PoolShare(self, limit)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+class PoolShare:
+    # Доля общего пула для одного потребителя (клиники): не больше limit его вызовов
+    # одновременно, чтобы перечитывание большого листа одной клиники не заняло все потоки
+    # и не задержало запись остальных.
+
+    def __init__(self, pool, limit):
+        self.pool = pool
+        self.limit = limit
+        self.in_flight = 0
+        self._sem = asyncio.Semaphore(limit)
+
+    async def run(self, func, *args, **kwargs):
+        self.in_flight += 1
+        try:
+            async with self._sem:
+                return await self.pool.run(func, *args, **kwargs)
+        finally:
+            self.in_flight -= 1
+
+    def metrics(self):
+        return {"in_flight": self.in_flight, "limit": self.limit}
@@ -0,0 +1,250 @@
+import threading
+from bisect import insort
+from collections import Counter, defaultdict
+from datetime import datetime
+from functools import lru_cache
+
+# Порядок колонок, в котором бот пишет строки (см. register_and_notify)
+DEFAULT_HEADER = ["Имя", "Телефон", "Услуга", "Дата", "Время", "Chat ID", "Создано"]
+# Список возможных названий столбца для Chat ID
+CHAT_ID_KEYS = ["Chat ID", "chat_id", "Chat Id", "chatid", "id"]
+# Колонки, которые бот меняет в уже существующей записи (не участвуют в опознании строки)
+MUTABLE_FIELDS = {"Время"}
+# Администраторы иногда вводят дату вручную в другом формате
+DATE_FORMATS = ("%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d.%m.%y")
+
+
+def _norm(value):
+    return str(value).strip()
+
+
+@lru_cache(maxsize=4096)
+def normalize_date(value):
+    value = _norm(value)
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%d.%m.%Y")
+        except ValueError:
+            continue
+    return value
+
+
+class BookingStore:
+    # Локальная копия листа записей. records[i] соответствует строке листа i + 2
+    # (первая строка — заголовок). Все поиски идут по индексам в памяти, без сети.
+    #
+    # Записи, ещё не отправленные в лист, помечены "_pending" и всегда лежат в конце списка;
+    # удалённые, но ещё не удалённые из листа — помечены "_deleted" и скрыты из индексов.
+    # Поэтому для синхронизированных строк номер строки листа по-прежнему равен i + 2.
+    #
+    # Индексы хранят сами записи и обновляются точечно: отмена и перенос меняют только ключи
+    # своей записи. Целиком они строятся заново только в load (и в редком extend посреди списка);
+    # remove пересчитывает лишь позиции записей после удалённых.
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.header = list(DEFAULT_HEADER)
+        self.chat_key = "Chat ID"
+        self.records = []
+        self.loaded_at = None
+        self.version = 0   # растёт при каждом изменении индексов
+        self._slots = defaultdict(Counter)   # (услуга.lower(), дата) -> Counter(время)
+        self._by_chat = defaultdict(list)    # chat_id -> [запись] в порядке строк
+        self._by_date = defaultdict(list)    # дата -> [запись] в порядке строк
+        self._by_identity = None             # identity -> [запись]; строится при первом find
+        self._pos = {}                       # id(запись) -> индекс в records
+        self._lock = threading.RLock()
+
+    # --- Загрузка ---
+    def refresh(self):
+        return self.load(self.sheet.get_all_values())
+
+    def load(self, values):
+        header = [_norm(h) for h in values[0]] if values and any(values[0]) else list(DEFAULT_HEADER)
+        records = [self._to_record(header, row) for row in values[1:]]
+        with self._lock:
+            self.header = header
+            self.chat_key = next((k for k in CHAT_ID_KEYS if k in header), "Chat ID")
+            self.records = records
+            self._reindex()
+            self.loaded_at = datetime.now()
+        return len(records)
+
+    @staticmethod
+    def _to_record(header, row):
+        row = list(row) + [""] * (len(header) - len(row))
+        return {key: row[i] for i, key in enumerate(header)}
+
+    def _reindex(self):
+        self.version += 1
+        self._pos = {id(rec): i for i, rec in enumerate(self.records)}
+        self._slots = defaultdict(Counter)
+        self._by_chat = defaultdict(list)
+        self._by_date = defaultdict(list)
+        self._by_identity = None
+        for rec in self.records:
+            if not rec.get("_deleted"):
+                self._index(rec)
+
+    def _indexes(self, rec):
+        # [(индекс, ключ записи в нём)]; индекс по identity — только если он уже построен
+        date = normalize_date(rec.get("Дата", ""))
+        indexes = [(self._by_chat, _norm(rec.get(self.chat_key, ""))), (self._by_date, date)]
+        if self._by_identity is not None:
+            indexes.append((self._by_identity, tuple(self.identity(rec))))
+        return (_norm(rec.get("Услуга", "")).lower(), date), _norm(rec.get("Время", "")), indexes
+
+    def _index(self, rec, ordered=False):
+        # ordered — запись не последняя в records (перенос): встаёт в списки по своей позиции
+        slot, time, indexes = self._indexes(rec)
+        self._slots[slot][time] += 1
+        for index, key in indexes:
+            if ordered:
+                insort(index[key], rec, key=lambda r: self._pos[id(r)])
+            else:
+                index[key].append(rec)
+
+    def _unindex(self, rec):
+        slot, time, indexes = self._indexes(rec)
+        counter = self._slots.get(slot)
+        if counter is not None:
+            counter[time] -= 1
+            if counter[time] <= 0:
+                del counter[time]
+        for index, key in indexes:
+            recs = index.get(key)
+            if not recs:
+                continue
+            for i in range(len(recs) - 1, -1, -1):
+                if recs[i] is rec:
+                    del recs[i]
+                    break
+            if not recs:
+                del index[key]
+
+    def _index_of(self, rec):
+        i = self._pos.get(id(rec))
+        return i if i is not None and i < len(self.records) and self.records[i] is rec else None
+
+    # --- Поиск ---
+    def taken_slots(self, service, date):
+        with self._lock:
+            counter = self._slots.get((service.strip().lower(), normalize_date(date)))
+            return [t for t, n in counter.items() if n > 0] if counter else []
+
+    def last_booking(self, chat_id):
+        with self._lock:
+            recs = self._by_chat.get(_norm(chat_id))
+            if not recs:
+                return None, None
+            rec = recs[-1]
+            return self._pos[id(rec)] + 2, rec
+
+    def on_date(self, date):
+        with self._lock:
+            return list(self._by_date.get(normalize_date(date), []))
+
+    def identity(self, rec):
+        return [_norm(rec.get(k, "")) for k in self.header if k not in MUTABLE_FIELDS]
+
+    def find(self, identity):
+        with self._lock:
+            if self._by_identity is None:
+                self._by_identity = defaultdict(list)
+                for rec in self.records:
+                    if not rec.get("_deleted"):
+                        self._by_identity[tuple(self.identity(rec))].append(rec)
+            recs = self._by_identity.get(tuple(identity))
+            return recs[-1] if recs else None
+
+    def resolve(self, rec):
+        # Запись могла быть перечитана из листа после того, как её показали пациенту
+        with self._lock:
+            if self._index_of(rec) is not None:
+                return None if rec.get("_deleted") else rec
+            return self.find(self.identity(rec))
+
+    def row_of(self, rec):
+        with self._lock:
+            i = self._index_of(rec)
+            return None if i is None else i + 2
+
+    def row_values(self, rec):
+        return [rec.get(k, "") for k in self.header]
+
+    def row_identity(self, row):
+        return self.identity(self._to_record(self.header, [_norm(v) for v in row]))
+
+    def matches(self, rec, row):
+        # Та же ли это строка листа (без учёта полей, которые бот сам меняет в очереди записи)
+        return self.identity(rec) == self.row_identity(row)
+
+    def synced_count(self):
+        # Сколько записей уже есть в листе: неотправленные всегда в конце списка
+        with self._lock:
+            n = len(self.records)
+            while n and self.records[n - 1].get("_pending"):
+                n -= 1
+            return n
+
+    # --- Изменения (вызываются очередью записи) ---
+    def append(self, row, pending=False):
+        with self._lock:
+            rec = self._to_record(self.header, [_norm(v) for v in row])
+            if pending:
+                rec["_pending"] = True
+            self._pos[id(rec)] = len(self.records)
+            self.records.append(rec)
+            self._index(rec)
+            self.version += 1
+            return rec
+
+    def extend(self, rows):
+        # Строки, появившиеся в листе после последней известной (их добавил администратор):
+        # встают после синхронизированных записей и перед ещё не отправленными
+        with self._lock:
+            at = self.synced_count()
+            recs = [self._to_record(self.header, row) for row in rows]
+            if at == len(self.records):
+                for rec in recs:
+                    self._pos[id(rec)] = len(self.records)
+                    self.records.append(rec)
+                    self._index(rec)
+                self.version += 1
+            else:
+                self.records[at:at] = recs
+                self._reindex()
+            return len(recs)
+
+    def mark_deleted(self, rec):
+        with self._lock:
+            if not rec.get("_deleted"):
+                self._unindex(rec)
+                rec["_deleted"] = True
+                self.version += 1
+
+    def set_field(self, rec, field, value):
+        with self._lock:
+            if rec.get("_deleted"):
+                rec[field] = _norm(value)
+                return
+            self._unindex(rec)
+            rec[field] = _norm(value)
+            self._index(rec, ordered=True)
+            self.version += 1
+
+    def remove(self, recs):
+        with self._lock:
+            drop = {id(r): r for r in recs if self._index_of(r) is not None}
+            if not drop:
+                return
+            for rec in drop.values():
+                if not rec.get("_deleted"):
+                    self._unindex(rec)
+            first = min(self._pos[i] for i in drop)
+            self.records[first:] = [r for r in self.records[first:] if id(r) not in drop]
+            for i in drop:
+                del self._pos[i]
+            for i in range(first, len(self.records)):
+                self._pos[id(self.records[i])] = i
+            self.version += 1
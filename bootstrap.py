@@ -0,0 +1,51 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class LazySheet:
+    # Лист Google Sheets, который открывается при первом обращении (авторизация и
+    # open_by_url идут по сети). connect() стоит вызывать из пула потоков, а не из event loop.
+
+    def __init__(self, opener):
+        self._opener = opener
+        self._sheet = None
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self._sheet is not None
+
+    def connect(self):
+        with self._lock:
+            if self._sheet is None:
+                self._sheet = self._opener()
+        return self._sheet
+
+    def __getattr__(self, name):
+        return getattr(self.connect(), name)
+
+
+class StartupTimer:
+    # Длительность фаз запуска и время от старта процесса до первого ответа.
+    # У каждой клиники свой таймер, отсчёт — от общего started процесса
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - start
+
+    def mark(self, name):
+        # Отметка "от старта процесса", записывается один раз
+        if name not in self.phases:
+            self.phases[name] = time.perf_counter() - self.started
+
+    def report(self):
+        return ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in self.phases.items())
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import weakref
+
+from service_matcher import ServiceMatcher
+
+logger = logging.getLogger("dataklinik")
+
+# Автомат услуг зависит только от содержимого файла: каталоги одной версии (у разных клиник
+# или до и после "пустой" правки) используют один экземпляр, пока он кому-то нужен
+_matchers = weakref.WeakValueDictionary()
+
+
+def normalize_name(name):
+    return str(name).strip().lower()
+
+
+def render_services_list(services):
+    lines = ["📋 *Список услуг:*"]
+    for i, s in enumerate(services, 1):
+        lines.append(f"{i}. *{s['название']}* — {s['цена']}")
+    return "\n".join(lines)
+
+
+def render_system_prompt(services):
+    services_text = []
+    for i, s in enumerate(services, 1):
+        line = f"{i}. {s['название']} — {s['цена']}"
+        if 'описание' in s:
+            line += f". {s['описание']}"
+        services_text.append(line)
+    services_prompt = "\n".join(services_text)
+    return (
+        "Ты — внимательный и доброжелательный администратор стоматологической клиники. "
+        "Объясняй услуги из списка, как будто общаешься с обычным человеком: просто, тепло, дружелюбно и по делу. "
+        "Если тебя спрашивают про что-то конкретное (например, 'пластинки', 'элайнеры', 'цены', 'прикус'), расскажи об этой услуге более подробно (цена, преимущества, показания, для кого подходит и т.д.). "
+        "Если вопрос общий — кратко перечисли основные услуги и спроси, нужна ли подробная консультация. "
+        "Если человек пока не просит записать его — НЕ переходи к регистрации и НЕ пиши ничего о записи. "
+        "Если тебя просят сравнить услуги — объясни плюсы и минусы каждой.\n"
+        f"Вот список услуг клиники:\n{services_prompt}"
+    )
+
+
+class Catalog:
+    # Неизменяемый снимок services.json со всем, что из него выводится: индексы по названию
+    # и номеру, автомат поиска услуг, готовый текст списка услуг и промпт для OpenAI.
+    # При изменении файла строится новый снимок целиком и подменяет старый одним присваиванием,
+    # поэтому обработчик, взявший снимок, видит согласованные данные до конца апдейта.
+
+    def __init__(self, raw):
+        self.version = hashlib.sha1(raw).hexdigest()[:12]
+        self.services_dict = json.loads(raw.decode("utf-8"))
+        self.services = list(self.services_dict.values())
+        self.by_name = {normalize_name(s["название"]): s for s in self.services}
+        self.matcher = _matchers.get(self.version)
+        if self.matcher is None:
+            self.matcher = _matchers[self.version] = ServiceMatcher(self.services_dict)
+        self.services_text = render_services_list(self.services)
+        self.system_prompt = render_system_prompt(self.services)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls(f.read())
+
+    def __len__(self):
+        return len(self.services)
+
+    def service(self, name):
+        return self.by_name.get(normalize_name(name))
+
+    def by_number(self, number):
+        # Номер из списка услуг, начиная с 1
+        if 1 <= number <= len(self.services):
+            return self.services[number - 1]
+        return None
+
+    def slots(self, name):
+        s = self.service(name)
+        return list(s.get("слоты", [])) if s else []
+
+
+class CatalogFile:
+    # services.json под наблюдением: check() (периодическая задача) сравнивает mtime и размер
+    # файла и при изменении собирает новый Catalog. Файл, который не читается или не
+    # разбирается (например, недописанный), не применяется — остаётся прежний каталог.
+    # Подписчики получают (старый, новый) каталог после подмены.
+
+    def __init__(self, path):
+        self.path = path
+        self._signature = self._stat()
+        self._failed = None
+        self._listeners = []
+        self.catalog = Catalog.load(path)
+        self.stats = {"reloads": 0, "reload_errors": 0}
+
+    def _stat(self):
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def subscribe(self, fn):
+        self._listeners.append(fn)
+
+    def check(self):
+        try:
+            signature = self._stat()
+        except OSError:
+            # Файл подменяют через rename — на следующей проверке он появится
+            return False
+        if signature == self._signature or signature == self._failed:
+            return False
+        try:
+            catalog = Catalog.load(self.path)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            self._failed = signature
+            self.stats["reload_errors"] += 1
+            logger.warning("%s: каталог услуг не применён, остаётся версия %s: %s",
+                           self.path, self.catalog.version, e)
+            return False
+        self._signature, self._failed = signature, None
+        if catalog.version == self.catalog.version:
+            return False
+        old, self.catalog = self.catalog, catalog
+        self.stats["reloads"] += 1
+        logger.info("%s: каталог услуг обновлён %s -> %s (%d услуг)",
+                    self.path, old.version, catalog.version, len(catalog))
+        for fn in self._listeners:
+            fn(old, catalog)
+        return True
+
+    def metrics(self):
+        return dict(self.stats, services=len(self.catalog))
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import metrics
+from admission import ChatAdmission
+from availability import AvailabilityEngine
+from bootstrap import StartupTimer
+from booking_store import BookingStore
+from catalog import CatalogFile
+from conversation_store import ConversationStore
+from notifications import NotificationQueue
+from reminders import ReminderDispatcher
+from write_queue import SheetWriteQueue
+
+logger = logging.getLogger("dataklinik")
+
+# Клиника из переменных окружения (TELEGRAM_TOKEN, SHEET_URL, services.json) — её файлы
+# состояния и вебхук остаются под прежними именами
+DEFAULT_CLINIC = "default"
+NAME_RE = re.compile(r"[a-z0-9_]+")
+
+
+def clinic_path(path, name):
+    # write_journal.jsonl -> write_journal.almaty.jsonl
+    if name == DEFAULT_CLINIC:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{name}{ext}"
+
+
+def load_tenants(path):
+    # Список клиник из JSON-файла:
+    # [{"name": "almaty", "token_env": "ALMATY_TELEGRAM_TOKEN", "sheet_url": "...",
+    #   "services": "services_almaty.json", "doctors_group_id": -100..., "max_concurrent": 16}]
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    tenants, seen = [], set()
+    for entry in entries:
+        name = str(entry.get("name", "")).strip()
+        if not NAME_RE.fullmatch(name) or name in seen:
+            raise ValueError(f"{path}: некорректное или повторяющееся имя клиники {name!r}")
+        seen.add(name)
+        token = entry.get("token") or os.getenv(entry.get("token_env", ""), "")
+        if not token.strip() or not entry.get("sheet_url") or "doctors_group_id" not in entry:
+            raise ValueError(f"{path}: для клиники {name} нужны token/token_env, sheet_url и doctors_group_id")
+        tenants.append({
+            "name": name,
+            "token": token.strip(),
+            "sheet_url": entry["sheet_url"],
+            "services": entry.get("services", "services.json"),
+            "doctors_group_id": int(entry["doctors_group_id"]),
+            "webhook": entry.get("webhook", "webhook" if name == DEFAULT_CLINIC else f"webhook/{name}"),
+            "max_concurrent": entry.get("max_concurrent"),
+        })
+    return tenants
+
+
+class Clinic:
+    # Одна клиника — один бот: свой лист записей с индексом и очередью записи, напоминания,
+    # каталог услуг, группа врачей и состояние диалогов. Пул потоков Sheets, клиент OpenAI,
+    # кэш консультаций и метрики общие для всех клиник процесса и передаются снаружи;
+    # sheets_io и openai_limit — доли клиники в общем пуле Sheets и общем лимите OpenAI.
+
+    def __init__(self, name, token, sheet, services_path, doctors_group_id, sheets_io, *,
+                 journal_path, state_path, reminders_path, notifications_path, openai_limit=None,
+                 webhook_path="webhook",
+                 max_concurrent=32, notify_window=3.0, notify_interval=3.0,
+                 flush_interval=2.0, flush_batch=100, reminder_offsets=(24, 2), telegram_rate=25,
+                 hold_seconds=300, state_hot_size=1000, state_ttl=24 * 3600, bookings_wait=20.0,
+                 full_sync_seconds=3600, chat_max_pending=5, coalesce_window=0.0, startup=None):
+        self.name = name
+        self.token = token
+        self.sheet = sheet
+        self.doctors_group_id = doctors_group_id
+        self.sheets_io = sheets_io
+        self.openai_limit = openai_limit
+        self.webhook_path = webhook_path
+        self.max_concurrent = max_concurrent
+        self.bookings_wait = bookings_wait
+        self.full_sync_seconds = full_sync_seconds
+        # Фазы загрузки клиники; startup — таймер процесса, от которого ведётся отсчёт
+        self.startup = StartupTimer(startup.started if startup else None)
+        # Каталог услуг перечитывается при изменении файла (check_catalog), без рестарта
+        self.catalog_file = CatalogFile(services_path)
+        self.catalog_file.subscribe(self._on_catalog_change)
+
+        # Локальный индекс записей: читаем лист один раз (в фоне после старта), дальше
+        # поддерживаем своими записями и периодически подтягиваем правки администраторов
+        self.bookings = BookingStore(sheet)
+        self.bookings_ready = asyncio.Event()
+        self.warmup_task = None
+        self.write_queue = SheetWriteQueue(
+            sheet, self.bookings, sheets_io, journal_path,
+            flush_interval=flush_interval, max_batch=flush_batch,
+        )
+        # Лимиты Telegram у каждого бота свои
+        self.reminders = ReminderDispatcher(self.bookings, reminders_path, reminder_offsets, rate=telegram_rate)
+        self.availability = AvailabilityEngine(self.bookings, self.catalog.services, hold_seconds)
+        self.conversations = ConversationStore(state_path, state_hot_size, state_ttl)
+        # Уведомления врачам уходят в фоне сводками, обработчик их только ставит в очередь
+        self.notifications = NotificationQueue(notifications_path, doctors_group_id, notify_window, notify_interval)
+        # Сообщения, пришедшие от чата во время его хода, ждут здесь и обрабатываются следующим ходом
+        self.admission = ChatAdmission(chat_max_pending, coalesce_window)
+        self._chat_locks = {}
+
+    def register_metrics(self):
+        labels = {"clinic": self.name}
+        metrics.register_stats("write_queue", self.write_queue.metrics, labels, counters=(
+            "flushes", "flush_errors", "syncs", "sync_rows", "sync_fallbacks", "full_reloads", "row_mismatches"))
+        metrics.register_stats("conversations", self.conversations.metrics, labels, counters=(
+            "hot_hits", "disk_hits", "misses", "expired"))
+        metrics.register_stats("reminders", self.reminders.metrics, labels, counters=(
+            "runs", "sent", "failed", "retried", "blocked", "skipped"))
+        metrics.register_stats("availability", self.availability.metrics, labels)
+        metrics.register_stats("catalog", self.catalog_file.metrics, labels, counters=("reloads", "reload_errors"))
+        metrics.register_stats("notifications", self.notifications.metrics, labels, counters=(
+            "queued", "sent", "digests", "retry_after", "errors", "dropped"))
+        metrics.register_stats("admission", self.admission.metrics, labels, counters=(
+            "updates", "turns", "coalesced", "shed"))
+        metrics.register_stats("clinic_sheets", self.sheets_io.metrics, labels)
+        if self.openai_limit is not None:
+            metrics.register_stats("clinic_openai_limit", self.openai_limit.metrics, labels,
+                                   counters=("admitted", "shed"))
+        metrics.register_stats("clinic_startup_seconds", lambda: self.startup.phases, labels, key_label="phase")
+
+    # --- Каталог услуг ---
+    @property
+    def catalog(self):
+        return self.catalog_file.catalog
+
+    def check_catalog(self):
+        return self.catalog_file.check()
+
+    def _on_catalog_change(self, old, new):
+        self.availability.set_services(new.services)
+
+    # --- Загрузка записей ---
+    async def warm_up(self):
+        # Подключение к листу, загрузка записей и журнала отложенных изменений; при сбое Sheets
+        # повторяем в фоне, а не роняем процесс
+        delay = 1
+        while True:
+            try:
+                with self.startup.phase("sheets_connect"):
+                    await self.sheets_io.run(self.sheet.connect)
+                with self.startup.phase("bookings_load"):
+                    await self.write_queue.refresh()
+                with self.startup.phase("journal_replay"):
+                    self.write_queue.replay()
+                break
+            except Exception:
+                logger.exception("[%s] Не удалось загрузить записи, повтор через %s с", self.name, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+        self.bookings_ready.set()
+        self.startup.mark("bookings_ready")
+        logger.info("[%s] Запуск: %s", self.name, self.startup.report())
+
+    def start_warmup(self):
+        if self.warmup_task is None:
+            self.warmup_task = asyncio.get_running_loop().create_task(self.warm_up())
+        return self.warmup_task
+
+    async def wait_bookings(self):
+        if self.bookings_ready.is_set():
+            return True
+        self.start_warmup()
+        try:
+            await asyncio.wait_for(self.bookings_ready.wait(), self.bookings_wait)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def refresh_bookings(self):
+        # Обычно дочитываем только новые строки в конце листа; полностью перечитываем лист
+        # раз в full_sync_seconds (правки в середине листа) и когда строки выше сдвинулись
+        if not self.bookings_ready.is_set():
+            return
+        age = (datetime.now() - self.bookings.loaded_at).total_seconds()
+        if age >= self.full_sync_seconds and await self.write_queue.refresh():
+            return
+        if await self.write_queue.sync() is None:
+            await self.write_queue.refresh()
+
+    async def send_reminders(self, bot):
+        if self.bookings_ready.is_set():
+            with metrics.timed("telegram", "reminders"):
+                await self.reminders.run(bot)
+
+    # --- Апдейты ---
+    @asynccontextmanager
+    async def chat_turn(self, chat_id):
+        # Апдейты разных чатов обрабатываются параллельно (до max_concurrent на клинику),
+        # апдейты одного чата — строго по очереди
+        entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat_id]
@@ -0,0 +1,70 @@
+import re
+import time
+from collections import OrderedDict
+
+# Слова, которые не меняют смысл вопроса о цене/услуге
+FILLER_WORDS = {
+    "а", "и", "ну", "вот", "скажите", "подскажите", "пожалуйста", "здравствуйте", "привет",
+    "добрый", "день", "вечер", "утро", "у", "вас", "мне", "бы", "хотел", "хотела", "узнать",
+}
+
+
+def normalize_question(text):
+    q = text.lower().replace("ё", "е")
+    words = re.findall(r"[a-zа-я0-9]+", q)
+    return " ".join(w for w in words if w not in FILLER_WORDS)
+
+
+class ResponseCache:
+    # LRU-кэш ответов консультанта с TTL. Ключ — нормализованный вопрос плюс версия
+    # services.json, так что смена цен автоматически делает старые ответы недоступными.
+
+    def __init__(self, max_size=512, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text, version):
+        return version, normalize_question(text)
+
+    def get(self, text, version):
+        key = self._key(text, version)
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, text, version, reply):
+        key = self._key(text, version)
+        if not key[1]:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, reply)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def drop_version(self, version):
+        # Ответы по старому каталогу услуг больше не нужны — освобождаем место сразу, не дожидаясь TTL
+        stale = [key for key in self._data if key[0] == version]
+        for key in stale:
+            del self._data[key]
+        return len(stale)
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def metrics(self):
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                "hit_ratio": self.hit_ratio}
@@ -0,0 +1,77 @@
+from conversation_store import estimate_tokens, trim_history
+
+SUMMARY_INSTRUCTIONS = (
+    "Сожми переписку пациента с администратором стоматологической клиники в краткое содержание "
+    "(не больше {words} слов): какие услуги и цены интересовали пациента, что ему уже ответили, "
+    "важные факты о нём (жалобы, ребёнок, удобное время). Только факты, без приветствий и оценок."
+)
+
+
+class ConversationMemory:
+    # Память консультанта в состоянии диалога: history — последние реплики пациента и бота,
+    # summary — краткое содержание более ранней переписки. Когда history превышает budget
+    # токенов, самые старые реплики сворачиваются в summary (в фоне, отдельным запросом к модели).
+    # Пока содержание не готово, промпт всё равно обрезается по бюджету, поэтому его размер
+    # не растёт с длиной диалога.
+
+    def __init__(self, budget=1500, message_tokens=500, summary_tokens=300):
+        self.budget = budget
+        self.message_tokens = message_tokens
+        self.summary_tokens = summary_tokens
+        self.stats = {"summaries": 0, "summary_errors": 0, "folded_turns": 0}
+
+    @staticmethod
+    def _clip(text, tokens):
+        # Та же оценка, что в estimate_tokens: ~4 символа на токен
+        limit = tokens * 4
+        return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+    def add(self, state, role, content):
+        # Слишком длинные сообщения храним и отправляем в модель обрезанными
+        state.setdefault("history", []).append({"role": role, "content": self._clip(content, self.message_tokens)})
+
+    def tokens(self, state):
+        return sum(estimate_tokens(m.get("content", "")) for m in state.get("history", []))
+
+    def prompt(self, state, system_prompt):
+        messages = [{"role": "system", "content": system_prompt}]
+        budget = self.budget
+        summary = state.get("summary")
+        if summary:
+            messages.append({"role": "system", "content": f"Краткое содержание предыдущей переписки: {summary}"})
+            budget -= estimate_tokens(summary)
+        return messages + trim_history(state.get("history", []), max(budget, 1))
+
+    # --- Сворачивание старых реплик ---
+    def needs_summary(self, state):
+        return self.tokens(state) > self.budget
+
+    def overflow(self, state):
+        # Самые старые реплики, после сворачивания которых история займёт не больше половины
+        # бюджета — чтобы не пересобирать содержание на каждом сообщении
+        history = state.get("history", [])
+        keep = trim_history(history, self.budget // 2)
+        return history[:len(history) - len(keep)]
+
+    def summary_request(self, state, turns):
+        lines = [f"{'Пациент' if m['role'] == 'user' else 'Администратор'}: {m['content']}" for m in turns]
+        previous = state.get("summary")
+        text = (f"Предыдущее содержание:\n{previous}\n\n" if previous else "") + "Новые реплики:\n" + "\n".join(lines)
+        return [
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(words=self.summary_tokens // 2)},
+            {"role": "user", "content": text},
+        ]
+
+    def fold(self, state, turns, summary):
+        # Применяет готовое содержание, если начало истории не изменилось, пока шёл запрос
+        history = state.get("history", [])
+        if not turns or history[:len(turns)] != turns:
+            return False
+        state["history"] = history[len(turns):]
+        state["summary"] = self._clip(summary.strip(), self.summary_tokens)
+        self.stats["summaries"] += 1
+        self.stats["folded_turns"] += len(turns)
+        return True
+
+    def metrics(self):
+        return dict(self.stats, budget=self.budget)
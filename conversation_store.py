@@ -0,0 +1,116 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+def estimate_tokens(text):
+    # Грубая оценка для русского/английского текста: ~4 символа на токен
+    return len(text) // 4 + 1
+
+
+def trim_history(history, budget):
+    # Оставляем самые свежие сообщения, пока их суммарный размер укладывается в бюджет токенов
+    kept, used = [], 0
+    for msg in reversed(history):
+        cost = estimate_tokens(msg.get("content", ""))
+        if kept and used + cost > budget:
+            break
+        kept.append(msg)
+        used += cost
+    kept.reverse()
+    return kept
+
+
+class ConversationStore:
+    # Состояние диалогов (state, form, free_slots, awaiting_slot, history) на диске в SQLite
+    # в виде сжатого JSON; в памяти держим только hot_size последних активных чатов.
+    # Диалоги, в которых ничего не происходило дольше ttl секунд, удаляются.
+
+    def __init__(self, path, hot_size=1000, ttl=24 * 3600):
+        self.path = path
+        self.hot_size = hot_size
+        self.ttl = ttl
+        self._hot = OrderedDict()   # chat_id -> (updated, data)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL, updated REAL NOT NULL)"
+        )
+        self.stats = {"hot_hits": 0, "disk_hits": 0, "misses": 0, "expired": 0}
+
+    @staticmethod
+    def _pack(data):
+        return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    @staticmethod
+    def _unpack(blob):
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+    def get(self, chat_id):
+        now = time.time()
+        with self._lock:
+            item = self._hot.get(chat_id)
+            if item is not None:
+                if now - item[0] <= self.ttl:
+                    self._hot.move_to_end(chat_id)
+                    self.stats["hot_hits"] += 1
+                    return item[1]
+                del self._hot[chat_id]
+            row = self._db.execute(
+                "SELECT data, updated FROM conversations WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return {}
+            if now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM conversations WHERE chat_id = ?", (chat_id,))
+                self.stats["expired"] += 1
+                return {}
+            data = self._unpack(row[0])
+            self._remember(chat_id, row[1], data)
+            self.stats["disk_hits"] += 1
+            return data
+
+    def put(self, chat_id, data):
+        now = time.time()
+        with self._lock:
+            if not data:
+                self._hot.pop(chat_id, None)
+                self._db.execute("DELETE FROM conversations WHERE chat_id = ?", (chat_id,))
+                return
+            self._db.execute(
+                "INSERT INTO conversations (chat_id, data, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+                (chat_id, self._pack(data), now),
+            )
+            self._remember(chat_id, now, data)
+
+    def _remember(self, chat_id, updated, data):
+        self._hot[chat_id] = (updated, data)
+        self._hot.move_to_end(chat_id)
+        while len(self._hot) > self.hot_size:
+            self._hot.popitem(last=False)
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for chat_id in [k for k, (updated, _) in self._hot.items() if updated < cutoff]:
+                del self._hot[chat_id]
+            removed = self._db.execute("DELETE FROM conversations WHERE updated < ?", (cutoff,)).rowcount
+            self.stats["expired"] += removed
+        return removed
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+    def metrics(self):
+        return dict(self.stats, hot=len(self._hot), hot_size=self.hot_size)
+
+    def close(self):
+        self._db.close()
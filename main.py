@@ -1,15 +1,29 @@
 import os
 import re
+import asyncio
 import json
-import gspread
+import time
+import logging
+import threading
 from datetime import datetime, timedelta
+
+from bootstrap import LazySheet, StartupTimer
+
+# Отсчёт фаз запуска начинаем до тяжёлых импортов
+startup = StartupTimer()
+
 from dotenv import load_dotenv
-from openai import OpenAI
 from telegram import Update
 from telegram.ext import ApplicationBuilder, ContextTypes, MessageHandler, filters
-from oauth2client.service_account import ServiceAccountCredentials
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+import metrics
+from admission import Limiter, Overloaded
+from blocking_io import BlockingPool
+from clinics import DEFAULT_CLINIC, Clinic, clinic_path, load_tenants
+from consult_cache import ResponseCache
+from conversation_memory import ConversationMemory
+
 # --- Настройки окружения и ключи ---
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "").strip()
@@ -17,26 +31,159 @@ RENDER_URL = os.getenv("RENDER_EXTERNAL_URL", "").strip()
 PORT = int(os.getenv("PORT", "10000").strip())
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
 DOCTORS_GROUP_ID = -1002529967465
-
-openai = OpenAI(api_key=OPENAI_API_KEY)
+# Как часто дочитывать новые строки листа и как часто перечитывать его целиком
+BOOKINGS_REFRESH_MINUTES = int(os.getenv("BOOKINGS_REFRESH_MINUTES", "1").strip())
+BOOKINGS_FULL_SYNC_MINUTES = int(os.getenv("BOOKINGS_FULL_SYNC_MINUTES", "60").strip())
+GOOGLE_SHEETS_KEY_FILE = os.getenv("GOOGLE_SHEETS_KEY_FILE", "/etc/secrets/GOOGLE_SHEETS_KEY").strip()
+# Сколько запросов к Sheets и OpenAI может выполняться одновременно
+SHEETS_CONCURRENCY = int(os.getenv("SHEETS_CONCURRENCY", "4").strip())
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8").strip())
+# Сколько запросов к OpenAI может ждать свободного слота; сверх этого пациент сразу получает "подождите"
+OPENAI_MAX_WAITING = int(os.getenv("OPENAI_MAX_WAITING", "32").strip())
+# Доля общих лимитов на одну клинику (пусто — всё для единственной клиники, половина, если их несколько),
+# чтобы всплеск в одной клинике не оставил остальных без OpenAI и Sheets
+OPENAI_CLINIC_CONCURRENCY = os.getenv("OPENAI_CLINIC_CONCURRENCY", "").strip()
+OPENAI_CLINIC_MAX_WAITING = os.getenv("OPENAI_CLINIC_MAX_WAITING", "").strip()
+SHEETS_CLINIC_CONCURRENCY = os.getenv("SHEETS_CLINIC_CONCURRENCY", "").strip()
+# Отложенная пакетная запись в лист
+WRITE_JOURNAL_FILE = os.getenv("WRITE_JOURNAL_FILE", "write_journal.jsonl").strip()
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "2").strip())
+WRITE_FLUSH_BATCH = int(os.getenv("WRITE_FLUSH_BATCH", "100").strip())
+# Консультации через OpenAI: кэш ответов и потоковая выдача
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o").strip()
+CONSULT_CACHE_SIZE = int(os.getenv("CONSULT_CACHE_SIZE", "512").strip())
+CONSULT_CACHE_TTL = int(os.getenv("CONSULT_CACHE_TTL", "3600").strip())
+OPENAI_STREAM = os.getenv("OPENAI_STREAM", "1").strip() == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0").strip())
+# Состояние диалогов: SQLite на диске + ограниченный горячий набор в памяти
+STATE_DB_FILE = os.getenv("STATE_DB_FILE", "conversations.sqlite3").strip()
+STATE_HOT_SIZE = int(os.getenv("STATE_HOT_SIZE", "1000").strip())
+STATE_TTL_HOURS = float(os.getenv("STATE_TTL_HOURS", "24").strip())
+# Память консультанта: бюджет токенов на историю, предел на одно сообщение и краткое содержание
+# старой переписки, которое в фоне собирает SUMMARY_MODEL
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500").strip())
+MESSAGE_TOKEN_LIMIT = int(os.getenv("MESSAGE_TOKEN_LIMIT", "500").strip())
+SUMMARY_TOKENS = int(os.getenv("SUMMARY_TOKENS", "300").strip())
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini").strip()
+# Напоминания: за сколько часов до приёма, как часто проверять и лимит Telegram (сообщений/сек)
+REMINDER_OFFSETS_HOURS = [int(h) for h in os.getenv("REMINDER_OFFSETS_HOURS", "24,2").split(",") if h.strip()]
+REMINDER_CHECK_MINUTES = int(os.getenv("REMINDER_CHECK_MINUTES", "5").strip())
+REMINDERS_DB_FILE = os.getenv("REMINDERS_DB_FILE", "reminders.sqlite3").strip()
+TELEGRAM_RATE = float(os.getenv("TELEGRAM_RATE", "25").strip())
+# Уведомления врачам: очередь на диске, окно сбора в сводку и минимальный интервал между сообщениями в группу
+NOTIFY_DB_FILE = os.getenv("NOTIFY_DB_FILE", "notifications.sqlite3").strip()
+NOTIFY_WINDOW_SECONDS = float(os.getenv("NOTIFY_WINDOW_SECONDS", "3").strip())
+NOTIFY_MIN_INTERVAL = float(os.getenv("NOTIFY_MIN_INTERVAL", "3").strip())
+# Сколько держим выбранный пациентом слот до подтверждения и где ищем альтернативы
+SLOT_HOLD_SECONDS = int(os.getenv("SLOT_HOLD_SECONDS", "300").strip())
+ALTERNATIVE_DAYS = int(os.getenv("ALTERNATIVE_DAYS", "7").strip())
+ALTERNATIVE_SLOTS = int(os.getenv("ALTERNATIVE_SLOTS", "5").strip())
+# Сколько обработчик записи ждёт первой загрузки листа после старта
+BOOKINGS_WAIT_SECONDS = float(os.getenv("BOOKINGS_WAIT_SECONDS", "20").strip())
+# Апдейты дольше TRACE_SLOW_MS пишутся в лог с разбивкой по операциям (пусто — выключено)
+TRACE_SLOW_MS = os.getenv("TRACE_SLOW_MS", "").strip()
+# Как часто проверять, не изменился ли services.json (изменения применяются без рестарта)
+CATALOG_CHECK_SECONDS = float(os.getenv("CATALOG_CHECK_SECONDS", "10").strip())
+# Несколько клиник в одном процессе: JSON-список клиник (см. clinics.load_tenants)
+TENANTS_FILE = os.getenv("TENANTS_FILE", "").strip()
+# Сколько апдейтов одной клиники обрабатывается одновременно
+CLINIC_MAX_CONCURRENT = int(os.getenv("CLINIC_MAX_CONCURRENT", "32").strip())
+# Сколько сообщений чата может ждать, пока идёт его ход, и сколько секунд собирать сообщения,
+# отправленные подряд, перед первым ходом (0 — не ждать)
+CHAT_MAX_PENDING = int(os.getenv("CHAT_MAX_PENDING", "5").strip())
+COALESCE_WINDOW_SECONDS = float(os.getenv("COALESCE_WINDOW_SECONDS", "0").strip())
+SHEET_URL = "https://docs.google.com/spreadsheets/d/1_w2CVitInb118oRGHgjsufuwsY4ks4H07aoJJMs_W5I/edit"
+
+logger = logging.getLogger("dataklinik")
+
+# Клиенты создаются при первом использовании (или в фоне из post_init), а не при импорте
+openai = None
+openai_limit = Limiter(OPENAI_CONCURRENCY, OPENAI_MAX_WAITING)
+
+def get_openai():
+    global openai
+    if openai is None:
+        from openai import AsyncOpenAI
+        openai = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    return openai
+
+# gspread синхронный — его вызовы уходят в отдельный пул потоков, а не в event loop
+sheets_io = BlockingPool(SHEETS_CONCURRENCY, name="sheets", observe=lambda op: metrics.timed("sheets", op))
 
 # --- Google Sheets ---
-with open("/etc/secrets/GOOGLE_SHEETS_KEY", "r") as f:
-    key_data = json.load(f)
-scope = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/drive"
-]
-creds = ServiceAccountCredentials.from_json_keyfile_dict(key_data, scope)
-client = gspread.authorize(creds)
-sheet = client.open_by_url(
-    "https://docs.google.com/spreadsheets/d/1_w2CVitInb118oRGHgjsufuwsY4ks4H07aoJJMs_W5I/edit"
-).sheet1
-
-# --- Услуги и слоты ---
-with open("services.json", "r", encoding="utf-8") as f:
-    SERVICES_DICT = json.load(f)
-SERVICES = list(SERVICES_DICT.values())
+# Один авторизованный клиент gspread на все клиники; листы открываются по своим URL
+gspread_client = None
+gspread_lock = threading.Lock()
+
+def get_gspread():
+    global gspread_client
+    with gspread_lock:
+        if gspread_client is None:
+            import gspread
+            from oauth2client.service_account import ServiceAccountCredentials
+            with open(GOOGLE_SHEETS_KEY_FILE, "r") as f:
+                key_data = json.load(f)
+            scope = [
+                "https://spreadsheets.google.com/feeds",
+                "https://www.googleapis.com/auth/drive"
+            ]
+            creds = ServiceAccountCredentials.from_json_keyfile_dict(key_data, scope)
+            gspread_client = gspread.authorize(creds)
+        return gspread_client
+
+def open_sheet(url=SHEET_URL):
+    return get_gspread().open_by_url(url).sheet1
+
+# --- Клиники ---
+# Каждая клиника — отдельный бот со своим листом, услугами, группой врачей и состоянием
+# диалогов (см. clinics.py). Без TENANTS_FILE работает одна клиника из переменных окружения.
+def clinic_share(total, configured, clinics_count):
+    if configured:
+        return max(1, min(int(configured), total))
+    return total if clinics_count == 1 else max(1, total // 2)
+
+def make_clinic(name, token, sheet_url, services, doctors_group_id, webhook, max_concurrent=None,
+                clinics_count=1):
+    # open_sheet берётся в момент подключения, чтобы его можно было подменить (bench/fakes.py)
+    sheet = LazySheet(lambda: open_sheet(sheet_url))
+    clinic = Clinic(
+        name, token, sheet, services, doctors_group_id,
+        sheets_io.share(clinic_share(SHEETS_CONCURRENCY, SHEETS_CLINIC_CONCURRENCY, clinics_count)),
+        openai_limit=Limiter(
+            clinic_share(OPENAI_CONCURRENCY, OPENAI_CLINIC_CONCURRENCY, clinics_count),
+            clinic_share(OPENAI_MAX_WAITING, OPENAI_CLINIC_MAX_WAITING, clinics_count),
+            parent=openai_limit,
+        ),
+        journal_path=clinic_path(WRITE_JOURNAL_FILE, name),
+        state_path=clinic_path(STATE_DB_FILE, name),
+        reminders_path=clinic_path(REMINDERS_DB_FILE, name),
+        notifications_path=clinic_path(NOTIFY_DB_FILE, name),
+        notify_window=NOTIFY_WINDOW_SECONDS, notify_interval=NOTIFY_MIN_INTERVAL,
+        webhook_path=webhook,
+        max_concurrent=max_concurrent or CLINIC_MAX_CONCURRENT,
+        flush_interval=WRITE_FLUSH_INTERVAL, flush_batch=WRITE_FLUSH_BATCH,
+        reminder_offsets=REMINDER_OFFSETS_HOURS, telegram_rate=TELEGRAM_RATE,
+        hold_seconds=SLOT_HOLD_SECONDS,
+        state_hot_size=STATE_HOT_SIZE, state_ttl=int(STATE_TTL_HOURS * 3600),
+        bookings_wait=BOOKINGS_WAIT_SECONDS, full_sync_seconds=BOOKINGS_FULL_SYNC_MINUTES * 60,
+        chat_max_pending=CHAT_MAX_PENDING, coalesce_window=COALESCE_WINDOW_SECONDS,
+        startup=startup,
+    )
+    clinic.catalog_file.subscribe(drop_stale_answers)
+    clinic.register_metrics()
+    return clinic
+
+def drop_stale_answers(old, new):
+    # Кэш консультаций общий для клиник: ответы по старой версии каталога удаляем,
+    # только если она больше ни у кого не осталась
+    if all(c.catalog.version != old.version for c in clinics):
+        consult_cache.drop_version(old.version)
+
+def load_clinics():
+    if not TENANTS_FILE:
+        return [make_clinic(DEFAULT_CLINIC, TELEGRAM_TOKEN, SHEET_URL, "services.json", DOCTORS_GROUP_ID, "webhook")]
+    tenants = load_tenants(TENANTS_FILE)
+    return [make_clinic(**tenant, clinics_count=len(tenants)) for tenant in tenants]
 
 CANCEL_KEYWORDS = ["отменить", "отмена", "удалить", "поменять время"]
 BOOKING_KEYWORDS = [
@@ -44,38 +191,40 @@ BOOKING_KEYWORDS = [
 ]
 CONSULT_WORDS = ["стоимость", "цена", "прайс", "услуги", "какие есть", "сколько стоит"]
 
-def is_cancel_intent(text):
-    q = text.lower()
-    return any(kw in q for kw in CANCEL_KEYWORDS)
-
-def is_booking_intent(text):
-    q = text.lower()
-    return any(kw in q for kw in BOOKING_KEYWORDS)
-
-def is_consult_intent(text):
-    q = text.lower()
-    return any(w in q for w in CONSULT_WORDS)
-
-def match_service(text):
+INTENT_PRIORITY = ("cancel", "booking", "consult")
+GREETINGS = {"Здравствуйте", "Привет", "Добрый", "Спасибо", "Пожалуйста"}
+
+def _alternation(words):
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+# Одно регулярное выражение на все сущности и ключевые слова: телефон раньше времени и даты,
+# время с двоеточием (или "в 10.30") раньше даты, чтобы "10:30" и "02.06" не путались
+MESSAGE_RE = re.compile(
+    r"(?P<phone>(?:\+7|8|7)?[\s\-(]*\d{3}[\s\-)]*\d{3}[\s\-]*\d{2}[\s\-]*\d{2}\b)"
+    r"|(?P<time>\b\d{1,2}:\d{2}\b|(?<=в )\d{1,2}[.\-]\d{2}\b)"
+    r"|(?P<date>сегодня|послезавтра|завтра|\b\d{1,2}[./-]\d{1,2}(?:[./-]\d{2,4})?\b)"
+    f"|(?P<cancel>{_alternation(CANCEL_KEYWORDS)})"
+    f"|(?P<booking>{_alternation(BOOKING_KEYWORDS)})"
+    f"|(?P<consult>{_alternation(CONSULT_WORDS)})"
+)
+NAME_SEGMENT_RE = re.compile(r"^\s*([А-ЯЁA-Z][а-яёa-z]+)\s*$")
+
+def match_service(catalog, text):
     q = text.lower()
     m = re.match(r"\b(\d{1,2})\b", q)
     if m:
-        idx = int(m.group(1)) - 1
-        if 0 <= idx < len(SERVICES):
-            return SERVICES[idx]["название"]
-    for key, s in SERVICES_DICT.items():
-        if s["название"].lower() in q:
+        s = catalog.by_number(int(m.group(1)))
+        if s:
             return s["название"]
-        for kw in s.get("ключи", []):
-            if kw.lower() in q:
-                return s["название"]
-    return None
+    return catalog.matcher.best(q)
 
-def build_services_list():
-    lines = ["📋 *Список услуг:*"]
-    for i, s in enumerate(SERVICES, 1):
-        lines.append(f"{i}. *{s['название']}* — {s['цена']}")
-    return "\n".join(lines)
+# Кэш консультаций общий: ответ зависит только от вопроса и версии каталога услуг
+consult_cache = ResponseCache(CONSULT_CACHE_SIZE, CONSULT_CACHE_TTL)
+openai_usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "in_flight": 0}
+memory = ConversationMemory(HISTORY_TOKEN_BUDGET, MESSAGE_TOKEN_LIMIT, SUMMARY_TOKENS)
+summary_tasks = {}   # (клиника, chat_id) -> задача сворачивания истории
+
+clinics = load_clinics()
 
 # --- Четкие функции вытаскивания полей ---
 def extract_name(text):
@@ -101,23 +250,26 @@ def extract_phone(text):
         return phone
     return None
 
-def extract_date(text):
+def parse_date(d):
+    # ДД.ММ.ГГГГ или None, если это не дата (например, время "10.30")
     date_keywords = {"сегодня": 0, "завтра": 1, "послезавтра": 2}
-    m = re.search(r"(сегодня|завтра|послезавтра|\d{1,2}[./-]\d{1,2}(?:[./-]\d{2,4})?)", text.lower())
     now = datetime.now()
+    if d in date_keywords:
+        return (now + timedelta(days=date_keywords[d])).strftime("%d.%m.%Y")
+    for fmt in ("%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y", "%d.%m", "%d/%m", "%d-%m"):
+        try:
+            date_obj = datetime.strptime(d, fmt)
+            if date_obj.year < 2000:
+                date_obj = date_obj.replace(year=now.year)
+            return date_obj.strftime("%d.%m.%Y")
+        except:
+            continue
+    return None
+
+def extract_date(text):
+    m = re.search(r"(сегодня|завтра|послезавтра|\d{1,2}[./-]\d{1,2}(?:[./-]\d{2,4})?)", text.lower())
     if m:
-        d = m.group(1)
-        if d in date_keywords:
-            return (now + timedelta(days=date_keywords[d])).strftime("%d.%m.%Y")
-        for fmt in ("%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y", "%d.%m", "%d/%m", "%d-%m"):
-            try:
-                date_obj = datetime.strptime(d, fmt)
-                if date_obj.year < 2000:
-                    date_obj = date_obj.replace(year=now.year)
-                return date_obj.strftime("%d.%m.%Y")
-            except:
-                continue
-        return d
+        return parse_date(m.group(1)) or m.group(1)
     return None
 
 def extract_time(text):
@@ -128,42 +280,58 @@ def extract_time(text):
             return f"{h:02d}:{m_}"
     return None
 
-def get_service_object(service_name):
-    for s in SERVICES:
-        if s["название"].strip().lower() == service_name.strip().lower():
-            return s
+def extract_name_from_segments(text, matcher):
+    # "запишите на чистку завтра в 10:30, Иван, 87001112233" — имя отдельным словом через запятую
+    for segment in reversed(text.split(",")[1:]):
+        m = NAME_SEGMENT_RE.match(segment)
+        if m and m.group(1) not in GREETINGS and not matcher.rank(m.group(1)):
+            return m.group(1)
     return None
 
+def parse_message(text, matcher):
+    # Намерение и все поля формы за один проход MESSAGE_RE и один проход автомата услуг
+    q = text.lower()
+    intents = set()
+    found = {}
+    for m in MESSAGE_RE.finditer(q):
+        kind = m.lastgroup
+        if kind in INTENT_PRIORITY:
+            intents.add(kind)
+        elif kind == "date" and parse_date(m.group(kind)) is None:
+            # Без "в " перед ним время через точку ("на 10.30") похоже на дату. Датой считаем
+            # только то, что разбирается как дата; остальное — возможно, время, иначе поле
+            # останется пустым и его спросит анкета
+            if re.fullmatch(r"\d{1,2}\.\d{2}", m.group(kind)):
+                found.setdefault("dotted_time", m.group(kind))
+        else:
+            found.setdefault(kind, m.group(kind))
+    time_text = found.get("time") or found.get("dotted_time")
+    services = matcher.rank(q)
+    name = None
+    m = re.search(r"(?:меня зовут|имя)\s*[:,\-]?\s*([А-ЯЁA-Z][а-яёa-zA-Z]+)", text, re.I)
+    if m:
+        name = m.group(1).capitalize()
+    else:
+        name = extract_name_from_segments(text, matcher)
+    return {
+        "intent": next((i for i in INTENT_PRIORITY if i in intents), None),
+        "intents": intents,
+        "service": services[0] if services else None,
+        "services": services,
+        "date": parse_date(found["date"]) if "date" in found else None,
+        "time": extract_time(time_text) if time_text else None,
+        "phone": extract_phone(re.sub(r"[^\d+]", "", found["phone"])) if "phone" in found else None,
+        "name": name,
+    }
+
 def is_form_complete(form):
     return all(form.get(k) for k in ("Имя", "Телефон", "Услуга", "Дата", "Время"))
 
-def get_taken_slots(услуга, дата):
-    records = sheet.get_all_records()
-    taken = []
-    for rec in records:
-        usluga_cell = str(rec.get("Услуга", "")).strip().lower()
-        date_cell = str(rec.get("Дата", "")).strip()
-        if usluga_cell == услуга.strip().lower() and date_cell == дата.strip():
-            time_cell = str(rec.get("Время", "")).strip()
-            taken.append(time_cell)
-    return taken
-
-def find_last_booking(chat_id):
-    records = sheet.get_all_records()
-    # Список возможных названий столбца для Chat ID
-    id_keys = ["Chat ID", "chat_id", "Chat Id", "chatid", "id"]
-    last = None
-    for idx, rec in enumerate(records, start=2):
-        rec_chat_id = None
-        for key in id_keys:
-            if key in rec:
-                rec_chat_id = rec[key]
-                break
-        if rec_chat_id is not None and str(rec_chat_id).strip() == str(chat_id).strip():
-            last = (idx, rec)
-    return last if last else (None, None)
+def find_last_booking(clinic, chat_id):
+    return clinic.bookings.last_booking(chat_id)
 
 async def register_and_notify(form, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    clinic = context.bot_data["clinic"]
     chat_id = update.effective_chat.id
     now_ts = datetime.now().strftime("%d.%m.%Y %H:%M")
     row = [
@@ -175,7 +343,14 @@ async def register_and_notify(form, update: Update, context: ContextTypes.DEFAUL
         chat_id,
         now_ts
     ]
-    sheet.append_row(row)
+    # Проверка и постановка в очередь без await между ними — слот не успеет занять другой пациент
+    if not clinic.availability.reserve(form["Услуга"], form["Дата"], form["Время"], chat_id):
+        form.pop("Время", None)
+        await update.message.reply_text("😔 Это время только что заняли. Выберите, пожалуйста, другое.")
+        await offer_slots(clinic, update, context.user_data, form)
+        return
+    clinic.write_queue.append(row)
+    metrics.EVENTS.labels("booking", clinic.name).inc()
     msg = (
         f"🦷 *Новая запись!*\n"
         f"Имя: {form['Имя']}\n"
@@ -184,39 +359,112 @@ async def register_and_notify(form, update: Update, context: ContextTypes.DEFAUL
         f"Дата: {form['Дата']}\n"
         f"Время: {form['Время']}"
     )
-    await context.bot.send_message(DOCTORS_GROUP_ID, msg, parse_mode="Markdown")
+    # Уведомление врачам уходит в фоне — пациент не ждёт отправки в группу
+    clinic.notifications.push(msg)
     await update.message.reply_text("✅ Запись подтверждена! Спасибо, ждём вас!")
     # Сброс состояния после успешной записи
     context.user_data.clear()
 
-async def handle_cancel_or_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.lower()
+BOOKINGS_UNAVAILABLE = "Запись временно недоступна, попробуйте, пожалуйста, через минуту."
+PLEASE_WAIT_BUSY = "⏳ Сейчас очень много обращений. Пожалуйста, подождите минуту и повторите вопрос."
+PLEASE_WAIT_CHAT = "⏳ Пожалуйста, подождите — я ещё отвечаю на ваши предыдущие сообщения."
+
+def get_free_slots(clinic, service_name, date, holder=None):
+    return clinic.availability.free(service_name, date, holder)
+
+async def offer_slots(clinic, update: Update, user_data, form):
+    if not await clinic.wait_bookings():
+        await update.message.reply_text(BOOKINGS_UNAVAILABLE)
+        return
+    free_slots = get_free_slots(clinic, form["Услуга"], form["Дата"], update.effective_chat.id)
+    if free_slots is None:
+        await update.message.reply_text("Ошибка: услуга не найдена. Попробуйте выбрать услугу заново.")
+        user_data["state"] = "reg_service"
+        return
+    if not free_slots:
+        nearest = clinic.availability.next_free(form["Услуга"], ALTERNATIVE_SLOTS, ALTERNATIVE_DAYS,
+                                         start=form["Дата"], holder=update.effective_chat.id)
+        if nearest:
+            lines = [f"• {d} {t}" for d, t in nearest]
+            await update.message.reply_text(
+                "На эту дату нет свободных слотов. Ближайшие свободные:\n" + "\n".join(lines)
+                + "\nНапишите удобную дату."
+            )
+        else:
+            await update.message.reply_text("На эту дату нет свободных слотов. Пожалуйста, введите другую дату.")
+        user_data["state"] = "reg_date"
+        return
+    slot_lines = [f"{i+1}. {slot}" for i, slot in enumerate(free_slots)]
+    await update.message.reply_text("Свободные слоты:\n" + "\n".join(slot_lines) + "\nНапишите номер или время.")
+    user_data["state"] = "reg_time"
+    user_data["free_slots"] = free_slots
+
+async def advance_booking(update: Update, context: ContextTypes.DEFAULT_TYPE, form):
+    # Переходим к первому незаполненному полю формы: всё, что пациент уже написал, не спрашиваем
+    clinic = context.bot_data["clinic"]
+    user_data = context.user_data
+    user_data["form"] = form
+    if not await clinic.wait_bookings():
+        await update.message.reply_text(BOOKINGS_UNAVAILABLE)
+        return
+    if not form.get("Услуга"):
+        user_data["state"] = "reg_service"
+        await update.message.reply_text("На какую услугу вы хотите записаться?\n" + clinic.catalog.services_text)
+        return
+    if not form.get("Имя"):
+        user_data["state"] = "reg_name"
+        await update.message.reply_text("Пожалуйста, напишите ваше имя для записи.")
+        return
+    if not form.get("Дата"):
+        user_data["state"] = "reg_date"
+        await update.message.reply_text("На какую дату вы хотите записаться? (например, 02.06.2025 или 'завтра')")
+        return
+    free_slots = get_free_slots(clinic, form["Услуга"], form["Дата"], update.effective_chat.id) or []
+    if not form.get("Время") or form["Время"] not in free_slots:
+        form.pop("Время", None)
+        await offer_slots(clinic, update, user_data, form)
+        return
+    # Держим выбранный слот за пациентом, пока он вводит телефон
+    clinic.availability.hold(form["Услуга"], form["Дата"], form["Время"], update.effective_chat.id)
+    if not form.get("Телефон"):
+        user_data["state"] = "reg_phone"
+        await update.message.reply_text("Пожалуйста, укажите ваш контактный телефон (например, +77001112233).")
+        return
+    if not is_form_complete(form):
+        await update.message.reply_text("Произошла ошибка заполнения формы, начните заново.")
+        user_data.clear()
+        return
+    await register_and_notify(form, update, context)
+
+async def handle_cancel_or_edit(update: Update, context: ContextTypes.DEFAULT_TYPE, text):
+    clinic = context.bot_data["clinic"]
+    text = text.lower()
     chat_id = update.effective_chat.id
-    row_idx, rec = find_last_booking(chat_id)
+    if not await clinic.wait_bookings():
+        await update.message.reply_text(BOOKINGS_UNAVAILABLE)
+        return
+    row_idx, rec = find_last_booking(clinic, chat_id)
     if not rec:
         await update.message.reply_text("❗ У вас нет активных записей.")
         return
     if "отменить" in text or "удалить" in text:
-        sheet.delete_row(row_idx)
+        clinic.write_queue.delete(rec)
+        metrics.EVENTS.labels("cancel", clinic.name).inc()
         msg = (
             f"❌ Пациент отменил запись:\n"
             f"{rec['Имя']}, {rec['Услуга']} на {rec['Дата']} {rec['Время']}"
         )
-        await context.bot.send_message(DOCTORS_GROUP_ID, msg, parse_mode="Markdown")
+        clinic.notifications.push(msg)
         await update.message.reply_text("✅ Ваша запись отменена.")
         return
     svc = rec["Услуга"]
     date = rec["Дата"]
-    slots = []
-    for key, s in SERVICES_DICT.items():
-        if s["название"].strip().lower() == svc.strip().lower():
-            slots = s.get("слоты", [])
-            break
+    slots = clinic.catalog.slots(svc)
     if not slots:
         await update.message.reply_text("Нет информации о слотах для этой услуги.")
         return
-    taken_slots = get_taken_slots(svc, date)
-    free_slots = [t for t in slots if t not in taken_slots or t == rec.get("Время")]
+    available = set(get_free_slots(clinic, svc, date, chat_id) or [])
+    free_slots = [t for t in slots if t in available or t == rec.get("Время")]
     if not free_slots:
         await update.message.reply_text("Все слоты на этот день заняты.")
         return
@@ -226,11 +474,12 @@ async def handle_cancel_or_edit(update: Update, context: ContextTypes.DEFAULT_TY
     await update.message.reply_text("\n".join(text_slots))
     context.user_data["awaiting_slot"] = {"row": row_idx, "slots": free_slots, "record": rec}
 
-async def handle_slot_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_slot_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, text):
+    clinic = context.bot_data["clinic"]
     state = context.user_data.get("awaiting_slot")
     if not state:
         return False
-    text = update.message.text.strip()
+    text = text.strip()
     if not re.fullmatch(r"\d+", text):
         return False
     idx = int(text) - 1
@@ -238,42 +487,139 @@ async def handle_slot_selection(update: Update, context: ContextTypes.DEFAULT_TY
     if idx < 0 or idx >= len(slots):
         return False
     new_time = slots[idx]
-    row_idx = state["row"]
-    sheet.update_cell(row_idx, 5, new_time)
     rec = state["record"]
-    await update.message.reply_text(f"✅ Время изменено на {new_time}.")
+    if not clinic.availability.reserve(rec["Услуга"], rec["Дата"], new_time, update.effective_chat.id,
+                                current=rec.get("Время")):
+        await update.message.reply_text("😔 Это время уже заняли. Выберите другой слот из списка.")
+        return True
+    if not clinic.write_queue.update(rec, "Время", new_time):
+        # Запись успели отменить или удалить из листа, пока пациент выбирал слот
+        del context.user_data["awaiting_slot"]
+        await update.message.reply_text("❗ Запись не найдена — возможно, она уже отменена.")
+        return True
+    metrics.EVENTS.labels("reschedule", clinic.name).inc()
     msg = (
         f"✏️ Пациент поменял время:\n"
         f"{rec['Имя']}, услуга {rec['Услуга']}\n"
         f"Новая дата/время: {rec['Дата']} {new_time}"
     )
-    await context.bot.send_message(DOCTORS_GROUP_ID, msg, parse_mode="Markdown")
+    clinic.notifications.push(msg)
+    await update.message.reply_text(f"✅ Время изменено на {new_time}.")
     del context.user_data["awaiting_slot"]
     return True
 
-async def send_reminders(context: ContextTypes.DEFAULT_TYPE):
-    today = datetime.now().strftime("%d.%m.%Y")
-    records = sheet.get_all_records()
-    for rec in records:
-        if rec.get("Дата") == today:
-            chat_id = rec.get("Chat ID")
-            svc = rec.get("Услуга")
-            time_ = rec.get("Время")
-            await context.bot.send_message(
-                chat_id,
-                f"🔔 Напоминание: у вас сегодня запись на *{svc}* в *{time_}*.",
-                parse_mode="Markdown"
-            )
-
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text.strip()
+def record_usage(usage):
+    openai_usage["requests"] += 1
+    if usage:
+        openai_usage["prompt_tokens"] += usage.prompt_tokens or 0
+        openai_usage["completion_tokens"] += usage.completion_tokens or 0
+
+async def ask_openai(clinic, update: Update, messages):
+    # Отправляет ответ пациенту и возвращает его текст (None при ошибке)
+    try:
+        async with clinic.openai_limit.slot():
+            openai_usage["in_flight"] += 1
+            try:
+                if OPENAI_STREAM:
+                    return await stream_openai(update, messages)
+                with metrics.timed("openai", "chat"):
+                    resp = await get_openai().chat.completions.create(model=OPENAI_MODEL, messages=messages)
+                record_usage(resp.usage)
+                reply = resp.choices[0].message.content
+                await update.message.reply_text(reply)
+                return reply
+            finally:
+                openai_usage["in_flight"] -= 1
+    except Overloaded:
+        await update.message.reply_text(PLEASE_WAIT_BUSY)
+        return None
+    except Exception:
+        logger.exception("Ошибка OpenAI")
+        await update.message.reply_text("Извините, сейчас не могу ответить 🤖")
+        return None
+
+async def stream_openai(update: Update, messages):
+    # Первое сообщение уходит с первыми токенами и дописывается не чаще раза
+    # в STREAM_EDIT_INTERVAL секунд (лимит Telegram на правки)
+    with metrics.timed("openai", "chat_first_token"):
+        stream = await get_openai().chat.completions.create(
+            model=OPENAI_MODEL, messages=messages, stream=True,
+            stream_options={"include_usage": True},
+        )
+    parts, sent, last_edit, usage = [], None, 0.0, None
+    with metrics.timed("openai", "chat_stream"):
+        async for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            parts.append(chunk.choices[0].delta.content)
+            now = time.monotonic()
+            if now - last_edit >= STREAM_EDIT_INTERVAL:
+                shown = "".join(parts)
+                if sent is None:
+                    sent = await update.message.reply_text(shown + " …")
+                else:
+                    await sent.edit_text(shown + " …")
+                last_edit = now
+    record_usage(usage)
+    reply = "".join(parts) or "Извините, сейчас не могу ответить 🤖"
+    if sent is None:
+        await update.message.reply_text(reply)
+    else:
+        await sent.edit_text(reply)
+    return reply
+
+def schedule_summary(clinic, chat_id):
+    key = (clinic.name, chat_id)
+    if key not in summary_tasks:
+        task = asyncio.get_running_loop().create_task(summarize_history(clinic, chat_id))
+        summary_tasks[key] = task
+        task.add_done_callback(lambda _: summary_tasks.pop(key, None))
+
+async def summarize_history(clinic, chat_id):
+    # Сворачивает старые реплики в краткое содержание. Состояние читается и обновляется
+    # в очереди чата (после сохранения текущего апдейта), запрос к модели идёт вне её
+    async with clinic.chat_turn(chat_id):
+        state = clinic.conversations.get(chat_id)
+        turns = memory.overflow(state)
+        request = memory.summary_request(state, turns)
+    if not turns:
+        return
+    try:
+        # При перегрузке содержание не собираем — попробуем на следующем сообщении
+        async with clinic.openai_limit.slot():
+            with metrics.timed("openai", "summary"):
+                resp = await get_openai().chat.completions.create(
+                    model=SUMMARY_MODEL, messages=request, max_tokens=SUMMARY_TOKENS,
+                )
+        summary = resp.choices[0].message.content or ""
+    except Overloaded:
+        return
+    except Exception:
+        memory.stats["summary_errors"] += 1
+        logger.exception("Не удалось сжать историю диалога")
+        return
+    if not summary.strip():
+        return
+    async with clinic.chat_turn(chat_id):
+        state = dict(clinic.conversations.get(chat_id))
+        if memory.fold(state, turns, summary):
+            clinic.conversations.put(chat_id, state)
+
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE, text=None):
+    # text — если несколько сообщений склеены в один ход (см. process_updates)
+    clinic = context.bot_data["clinic"]
+    text = (update.message.text if text is None else text).strip()
     user_data = context.user_data
+    catalog = clinic.catalog
+    parsed = parse_message(text, catalog.matcher)
 
     # --- Блок отмены/изменения записи и слотов не трогаем ---
-    if is_cancel_intent(text):
-        return await handle_cancel_or_edit(update, context)
+    if parsed["intent"] == "cancel":
+        return await handle_cancel_or_edit(update, context, text)
     if user_data.get("awaiting_slot"):
-        handled = await handle_slot_selection(update, context)
+        handled = await handle_slot_selection(update, context, text)
         if handled:
             return
 
@@ -283,82 +629,41 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # --- КОНСУЛЬТАЦИОННЫЙ РЕЖИМ ---
     if state == "consult":
         # --- 1. Сначала проверяем: хочет ли пользователь записаться? ---
-        if is_booking_intent(text):
-            service_candidate = match_service(text)
-            if service_candidate:
-                form["Услуга"] = service_candidate
-                user_data["form"] = form
-                user_data["state"] = "reg_name"
-                await update.message.reply_text("Пожалуйста, напишите ваше имя для записи.")
-                return
-            await update.message.reply_text("На какую услугу вы хотите записаться?\n" + build_services_list())
-            user_data["state"] = "reg_service"
-            user_data["form"] = form
-            return
+        # Всё, что пациент сразу указал (услуга, дата, время, имя, телефон), заполняем без вопросов
+        if parsed["intent"] == "booking":
+            for field, key in (("Услуга", "service"), ("Имя", "name"), ("Дата", "date"),
+                               ("Время", "time"), ("Телефон", "phone")):
+                if parsed[key]:
+                    form[field] = parsed[key]
+            return await advance_booking(update, context, form)
 
         # --- 2. Всё остальное: консультация через OpenAI ---
-        services_text = []
-        for i, s in enumerate(SERVICES, 1):
-            line = f"{i}. {s['название']} — {s['цена']}"
-            if 'описание' in s:
-                line += f". {s['описание']}"
-            services_text.append(line)
-        services_prompt = "\n".join(services_text)
-
-        system_prompt = (
-            "Ты — внимательный и доброжелательный администратор стоматологической клиники. "
-            "Объясняй услуги из списка, как будто общаешься с обычным человеком: просто, тепло, дружелюбно и по делу. "
-            "Если тебя спрашивают про что-то конкретное (например, 'пластинки', 'элайнеры', 'цены', 'прикус'), расскажи об этой услуге более подробно (цена, преимущества, показания, для кого подходит и т.д.). "
-            "Если вопрос общий — кратко перечисли основные услуги и спроси, нужна ли подробная консультация. "
-            "Если человек пока не просит записать его — НЕ переходи к регистрации и НЕ пиши ничего о записи. "
-            "Если тебя просят сравнить услуги — объясни плюсы и минусы каждой.\n"
-            f"Вот список услуг клиники:\n{services_prompt}"
-        )
-
-        history = user_data.get("history", [])
-        history.append({"role": "user", "content": text})
-        user_data["history"] = history[-10:]
-        messages = [{"role": "system", "content": system_prompt}] + history[-10:]
-
-        try:
-            resp = openai.chat.completions.create(model="gpt-4o", messages=messages)
-            reply = resp.choices[0].message.content
-        except Exception:
-            reply = "Извините, сейчас не могу ответить 🤖"
-        await update.message.reply_text(reply)
-        return
-
-        # Если пользователь сразу пишет "записаться на ...", начни оформление
-        if is_booking_intent(text):
-            service_candidate = match_service(text)
-            if service_candidate:
-                form["Услуга"] = service_candidate
-                user_data["form"] = form
-                user_data["state"] = "reg_name"
-                await update.message.reply_text("Пожалуйста, напишите ваше имя для записи.")
-                return
-            # Если услуга не найдена, просим выбрать услугу из списка
-            await update.message.reply_text("На какую услугу вы хотите записаться?\n" + build_services_list())
-            user_data["state"] = "reg_service"
-            user_data["form"] = form
-            return
-
-        # Если ничего из вышеперечисленного — просто консультация
-        await update.message.reply_text(
-            "Здравствуйте! Чем могу помочь? Если хотите узнать об услугах или записаться — напишите."
-        )
+        # Из кэша отвечаем только на первый вопрос в чате: дальше ответ модели зависит от истории
+        # диалога (и может содержать данные пациента), а ключ кэша — только текст вопроса.
+        # В память консультанта попадают реплики обеих сторон, включая ответы из кэша
+        cacheable = not user_data.get("history") and not user_data.get("summary")
+        memory.add(user_data, "user", text)
+        reply = consult_cache.get(text, catalog.version) if cacheable else None
+        if reply:
+            await update.message.reply_text(reply)
+        else:
+            reply = await ask_openai(clinic, update, memory.prompt(user_data, catalog.system_prompt))
+            if reply and cacheable:
+                consult_cache.put(text, catalog.version, reply)
+        if reply:
+            memory.add(user_data, "assistant", reply)
+        if memory.needs_summary(user_data):
+            schedule_summary(clinic, update.effective_chat.id)
         return
 
     # 3. Выбор услуги, если сразу не была указана
     if state == "reg_service":
-        service_candidate = match_service(text)
+        service_candidate = match_service(catalog, text)
         if service_candidate:
             form["Услуга"] = service_candidate
-            user_data["form"] = form
-            user_data["state"] = "reg_name"
-            await update.message.reply_text("Пожалуйста, напишите ваше имя для записи.")
+            await advance_booking(update, context, form)
         else:
-            await update.message.reply_text("Пожалуйста, выберите услугу из списка:\n" + build_services_list())
+            await update.message.reply_text("Пожалуйста, выберите услугу из списка:\n" + catalog.services_text)
         return
 
     # 4. Имя
@@ -366,9 +671,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         name = extract_name(text)
         if name:
             form["Имя"] = name
-            user_data["form"] = form
-            user_data["state"] = "reg_date"
-            await update.message.reply_text("На какую дату вы хотите записаться? (например, 02.06.2025 или 'завтра')")
+            await advance_booking(update, context, form)
         else:
             await update.message.reply_text("Пожалуйста, укажите ваше имя (например, 'Я Иван').")
         return
@@ -379,20 +682,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if date:
             form["Дата"] = date
             user_data["form"] = form
-            user_data["state"] = "reg_time"
-            service_obj = get_service_object(form["Услуга"])
-            if not service_obj:
-                await update.message.reply_text("Ошибка: услуга не найдена. Попробуйте выбрать услугу заново.")
-                user_data["state"] = "reg_service"
-                return
-            taken_slots = get_taken_slots(form["Услуга"], date)
-            free_slots = [t for t in service_obj.get("слоты", []) if t not in taken_slots]
-            if not free_slots:
-                await update.message.reply_text("На эту дату нет свободных слотов. Пожалуйста, введите другую дату.")
-                return
-            slot_lines = [f"{i+1}. {slot}" for i, slot in enumerate(free_slots)]
-            await update.message.reply_text("Свободные слоты:\n" + "\n".join(slot_lines) + "\nНапишите номер или время.")
-            user_data["free_slots"] = free_slots
+            await offer_slots(clinic, update, user_data, form)
         else:
             await update.message.reply_text("Пожалуйста, напишите дату в формате ДД.ММ.ГГГГ или 'завтра'.")
         return
@@ -412,9 +702,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     chosen_time = t
         if chosen_time:
             form["Время"] = chosen_time
-            user_data["form"] = form
-            user_data["state"] = "reg_phone"
-            await update.message.reply_text("Пожалуйста, укажите ваш контактный телефон (например, +77001112233).")
+            await advance_booking(update, context, form)
         else:
             slot_lines = [f"{i+1}. {slot}" for i, slot in enumerate(free_slots)]
             await update.message.reply_text("Пожалуйста, выберите время только из списка:\n" + "\n".join(slot_lines))
@@ -425,31 +713,143 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         phone = extract_phone(text)
         if phone:
             form["Телефон"] = phone
-            user_data["form"] = form
-            # Всё собрано, делаем запись
-            if is_form_complete(form):
-                await register_and_notify(form, update, context)
-                user_data.clear()
-                return
-            else:
-                await update.message.reply_text("Произошла ошибка заполнения формы, начните заново.")
-                user_data.clear()
-                return
+            # Всё собрано — advance_booking перепроверит слот и сделает запись
+            await advance_booking(update, context, form)
+            return
         else:
             await update.message.reply_text("Пожалуйста, введите телефон в формате +77001112233.")
         return
 
-def main():
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+async def handle_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Апдейты одного чата идут по очереди: пока идёт ход, новые сообщения чата ждут в очереди
+    # клиники, а этот обработчик сразу освобождает слот Application для других чатов
+    clinic = context.bot_data["clinic"]
+    accepted = await clinic.admission.submit(
+        update.effective_chat.id, update, lambda batch: process_updates(clinic, context, batch),
+    )
+    if not accepted:
+        await update.message.reply_text(PLEASE_WAIT_CHAT)
+
+async def process_updates(clinic, context, updates):
+    # Несколько сообщений, отправленных подряд во время консультации, — один вопрос и один
+    # ответ модели. В записи и при выборе слота каждое сообщение — отдельный шаг анкеты
+    chat_id = updates[-1].effective_chat.id
+    if len(updates) > 1:
+        state = clinic.conversations.get(chat_id)
+        if state.get("state", "consult") == "consult" and not state.get("awaiting_slot"):
+            clinic.admission.stats["coalesced"] += len(updates) - 1
+            text = "\n".join(u.message.text.strip() for u in updates)
+            return await run_turn(clinic, context, updates[-1], text)
+    for update in updates:
+        await run_turn(clinic, context, update)
+
+async def run_turn(clinic, context, update, text=None):
+    # Состояние диалога живёт в ConversationStore клиники, а не в памяти Application:
+    # подгружаем его в user_data на время обработки и сохраняем обратно
+    chat_id = update.effective_chat.id
+    slow = float(TRACE_SLOW_MS) / 1000 if TRACE_SLOW_MS else None
+    async with clinic.chat_turn(chat_id):
+        with metrics.trace_update(f"clinic={clinic.name} chat={chat_id}", slow):
+            with metrics.span("state_load"):
+                context.user_data.clear()
+                context.user_data.update(clinic.conversations.get(chat_id))
+            user_data = context.user_data
+            stage = "reschedule" if user_data.get("awaiting_slot") else user_data.get("state", "consult")
+            try:
+                with metrics.span(f"handler.{stage}"), metrics.HANDLER_SECONDS.labels(stage).time():
+                    await handle_message(update, context, text)
+            finally:
+                with metrics.span("state_save"):
+                    clinic.conversations.put(chat_id, dict(context.user_data))
+                clinic.startup.mark("first_response")
+                if update.effective_user:
+                    context.application.drop_user_data(update.effective_user.id)
+
+# --- Метрики ---
+metrics.register_stats("consult_cache", consult_cache.metrics, counters=("hits", "misses"))
+metrics.register_stats("openai", lambda: openai_usage, counters=("requests", "prompt_tokens", "completion_tokens"))
+metrics.register_stats("openai_limit", openai_limit.metrics, counters=("admitted", "shed"))
+metrics.register_stats("memory", memory.metrics, counters=("summaries", "summary_errors", "folded_turns"))
+metrics.register_stats("startup_seconds", lambda: startup.phases, key_label="phase")
+metrics.register_gauge("bot_sheets_in_flight", "Вызовы gspread в работе", lambda: sheets_io.in_flight)
+metrics.register_gauge("bot_sheets_queued", "Вызовы gspread, ждущие свободного потока", lambda: sheets_io.queued)
+
+async def serve(apps, base_url):
+    # Свой веб-сервер вместо app.run_webhook: все боты процесса принимают вебхуки на одном порту
+    # (каждый на своём пути), там же отдаём /metrics
+    import signal
+    from contextlib import AsyncExitStack
+    import tornado.web
+
+    class WebhookHandler(tornado.web.RequestHandler):
+        def initialize(self, app):
+            self.app = app
+
+        async def post(self):
+            await self.app.update_queue.put(Update.de_json(json.loads(self.request.body), self.app.bot))
+
+    class MetricsHandler(tornado.web.RequestHandler):
+        def get(self):
+            body, content_type = metrics.render()
+            self.set_header("Content-Type", content_type)
+            self.write(body)
+
+    routes = [(f"/{app.bot_data['clinic'].webhook_path}", WebhookHandler, {"app": app}) for app in apps]
+    web = tornado.web.Application(routes + [(r"/metrics", MetricsHandler)])
+    server = web.listen(PORT, address="0.0.0.0")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    async with AsyncExitStack() as stack:
+        for app in apps:
+            await stack.enter_async_context(app)
+            await app.post_init(app)
+            await app.bot.set_webhook(f"{base_url}/{app.bot_data['clinic'].webhook_path}", drop_pending_updates=True)
+            await app.start()
+        try:
+            await stop.wait()
+        finally:
+            server.stop()
+            for app in apps:
+                await app.stop()
+                await app.post_shutdown(app)
+
+startup.mark("import")
+
+def build_app(clinic, scheduler):
+    # Апдейты разных чатов клиники обрабатываются параллельно, не больше max_concurrent сразу
+    app = ApplicationBuilder().token(clinic.token).concurrent_updates(clinic.max_concurrent).build()
+    app.bot_data["clinic"] = clinic
+    # Апдейты, принятые вебхуком, но ещё не взятые обработчиком (все слоты клиники заняты)
+    metrics.register_stats("updates", lambda: {"queued": app.update_queue.qsize()}, {"clinic": clinic.name})
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_update))
+
+    async def start_jobs(_: ContextTypes.DEFAULT_TYPE):
+        # Клиенты и кэш записей прогреваются в фоне — вебхук начинает принимать апдейты сразу
+        clinic.start_warmup()
+        clinic.notifications.start(app.bot)
+        scheduler.add_job(clinic.send_reminders, "interval", minutes=REMINDER_CHECK_MINUTES, args=[app.bot])
+        scheduler.add_job(clinic.refresh_bookings, "interval", minutes=BOOKINGS_REFRESH_MINUTES)
+        scheduler.add_job(clinic.write_queue.flush, "interval", seconds=WRITE_FLUSH_INTERVAL)
+        scheduler.add_job(clinic.conversations.expire, "interval", hours=1)
+        scheduler.add_job(clinic.check_catalog, "interval", seconds=CATALOG_CHECK_SECONDS)
+        if not scheduler.running:
+            asyncio.get_running_loop().create_task(asyncio.to_thread(get_openai))
+            scheduler.start()
+
+    async def flush_queues(_: ContextTypes.DEFAULT_TYPE):
+        await clinic.notifications.stop(app.bot)
+        await clinic.write_queue.flush()
+
+    app.post_init = start_jobs
+    app.post_shutdown = flush_queues
+    return app
 
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     scheduler = AsyncIOScheduler()
-
-    async def start_scheduler(_: ContextTypes.DEFAULT_TYPE):
-        scheduler.add_job(send_reminders, "cron", hour=9, minute=0, args=[app.bot])
-        scheduler.start()
-
-    app.post_init = start_scheduler
+    apps = [build_app(clinic, scheduler) for clinic in clinics]
 
     RENDER_URL = os.getenv("RENDER_EXTERNAL_URL", "").strip()
     if RENDER_URL.startswith("https://"):
@@ -458,15 +858,8 @@ def main():
         RENDER_URL = RENDER_URL.replace("http://", "")
     if RENDER_URL.endswith("/"):
         RENDER_URL = RENDER_URL.rstrip("/")
-    webhook = f"https://{RENDER_URL}/webhook"
-
-    app.run_webhook(
-        listen="0.0.0.0",
-        port=PORT,
-        url_path="webhook",
-        webhook_url=webhook,
-        drop_pending_updates=True,
-    )
+
+    asyncio.run(serve(apps, f"https://{RENDER_URL}"))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,128 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger("dataklinik.trace")
+
+REGISTRY = CollectorRegistry()
+
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Время обработки сообщения по состоянию диалога",
+    ["stage"], registry=REGISTRY,
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+BACKEND_SECONDS = Histogram(
+    "bot_backend_seconds", "Длительность вызовов внешних сервисов",
+    ["backend", "op"], registry=REGISTRY,
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+)
+BACKEND_ERRORS = Counter(
+    "bot_backend_errors_total", "Ошибки вызовов внешних сервисов", ["backend", "op"], registry=REGISTRY,
+)
+EVENTS = Counter(
+    "bot_events_total", "События записи: booking, cancel, reschedule", ["event", "clinic"], registry=REGISTRY,
+)
+
+
+# --- Показатели из stats-словарей компонентов (очередь записи, кэши, напоминания) ---
+# Компоненты, которые есть у каждой клиники, регистрируются с меткой clinic: одноимённые
+# показатели разных клиник попадают в одно семейство. Ключи из counters только растут —
+# они экспортируются счётчиками (bot_<prefix>_<key>_total), чтобы работал rate(), остальные —
+# gauge. С key_label ключи словаря становятся значениями этой метки одного семейства
+# bot_<prefix> (например, фазы запуска).
+class StatsCollector:
+    def __init__(self):
+        self._sources = {}
+
+    def add(self, prefix, fn, labels=None, counters=(), key_label=None):
+        key = (prefix, tuple(sorted((labels or {}).items())))
+        self._sources[key] = (fn, frozenset(counters), key_label)
+
+    def collect(self):
+        families = {}
+        for (prefix, labels), (fn, counters, key_label) in self._sources.items():
+            try:
+                stats = fn()
+            except Exception:
+                continue
+            label_names = [k for k, _ in labels] + ([key_label] if key_label else [])
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"bot_{prefix}" if key_label else f"bot_{prefix}_{key}"
+                family = families.get(name)
+                if family is None:
+                    kind = CounterMetricFamily if key in counters else GaugeMetricFamily
+                    family = families[name] = kind(name, prefix if key_label else f"{prefix}.{key}",
+                                                   labels=label_names)
+                family.add_metric([v for _, v in labels] + ([key] if key_label else []), value)
+        return list(families.values())
+
+
+STATS = StatsCollector()
+REGISTRY.register(STATS)
+
+
+def register_stats(prefix, fn, labels=None, counters=(), key_label=None):
+    STATS.add(prefix, fn, labels, counters, key_label)
+
+
+def register_gauge(name, doc, fn):
+    gauge = Gauge(name, doc, registry=REGISTRY)
+    gauge.set_function(fn)
+    return gauge
+
+
+def render():
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+# --- Трассировка апдейта ---
+# Каждый апдейт собирает список (операция, секунды); медленные апдейты пишутся в лог целиком
+_trace = ContextVar("trace", default=None)
+
+
+@contextmanager
+def trace_update(name, slow_seconds):
+    spans = []
+    token = _trace.set(spans)
+    start = time.perf_counter()
+    try:
+        yield spans
+    finally:
+        _trace.reset(token)
+        total = time.perf_counter() - start
+        if slow_seconds is not None and total >= slow_seconds:
+            parts = ", ".join(f"{op}={sec * 1000:.0f}ms" for op, sec in spans)
+            logger.info("slow update %s: %.0fms [%s]", name, total * 1000, parts)
+
+
+@contextmanager
+def span(op):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans = _trace.get()
+        if spans is not None:
+            spans.append((op, time.perf_counter() - start))
+
+
+@contextmanager
+def timed(backend, op):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        BACKEND_ERRORS.labels(backend, op).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        BACKEND_SECONDS.labels(backend, op).observe(elapsed)
+        spans = _trace.get()
+        if spans is not None:
+            spans.append((f"{backend}.{op}", elapsed))
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from contextlib import suppress
+
+from telegram.error import Forbidden, BadRequest, RetryAfter, TimedOut, NetworkError
+
+logger = logging.getLogger("dataklinik")
+
+# Лимит Telegram на длину сообщения — 4096 символов; запас оставляем под заголовок сводки
+MAX_MESSAGE_CHARS = 4000
+
+
+class NotificationQueue:
+    # Уведомления в группу врачей. Обработчик только кладёт текст в очередь (SQLite на диске,
+    # рестарт ничего не теряет) и сразу отвечает пациенту; отправляет фоновая задача.
+    # Всё, что накопилось за window секунд, уходит одной сводкой; в группу пишем не чаще раза
+    # в min_interval секунд (у Telegram отдельный лимит на групповые чаты), на RetryAfter ждём
+    # столько, сколько просит Telegram. Доставка "хотя бы раз": уведомление удаляется из
+    # очереди только после успешной отправки.
+
+    def __init__(self, db_path, chat_id, window=3.0, min_interval=3.0, max_backoff=60.0):
+        self.chat_id = chat_id
+        self.window = window
+        self.min_interval = min_interval
+        self.max_backoff = max_backoff
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS notifications ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._wake = asyncio.Event()
+        self._task = None
+        self._last_sent = 0.0
+        self.stats = {"queued": 0, "sent": 0, "digests": 0, "retry_after": 0, "errors": 0, "dropped": 0}
+
+    def push(self, text):
+        self._db.execute("INSERT INTO notifications (text, created) VALUES (?, ?)", (text, time.time()))
+        self.stats["queued"] += 1
+        self._wake.set()
+
+    @property
+    def pending(self):
+        return self._db.execute("SELECT COUNT(*) FROM notifications").fetchone()[0]
+
+    def _batch(self):
+        rows = self._db.execute("SELECT id, text FROM notifications ORDER BY id LIMIT 100").fetchall()
+        ids, parts, size = [], [], 0
+        for id_, text in rows:
+            text = text[:MAX_MESSAGE_CHARS]
+            if parts and size + len(text) + 2 > MAX_MESSAGE_CHARS:
+                break
+            ids.append(id_)
+            parts.append(text)
+            size += len(text) + 2
+        return ids, parts
+
+    @staticmethod
+    def render(parts):
+        if len(parts) == 1:
+            return parts[0]
+        return f"📋 *Сводка: {len(parts)} уведомлений*\n\n" + "\n\n".join(parts)
+
+    # --- Отправка ---
+    def start(self, bot):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(bot))
+            if self.pending:
+                self._wake.set()
+
+    async def stop(self, bot, timeout=5.0):
+        # Последняя попытка отправить очередь перед остановкой; что не успели — останется на диске
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._drain(bot), timeout)
+
+    async def _run(self, bot):
+        while True:
+            await self._wake.wait()
+            # Окно сбора: всё, что придёт за window секунд, уйдёт одной сводкой
+            await asyncio.sleep(self.window)
+            self._wake.clear()
+            try:
+                await self._drain(bot)
+            except Exception:
+                logger.exception("Ошибка отправки уведомлений врачам")
+                self._wake.set()
+                await asyncio.sleep(self.max_backoff)
+
+    async def _drain(self, bot):
+        while await self._send_next(bot):
+            pass
+
+    async def _send_next(self, bot):
+        # Одна сводка из начала очереди; False — очередь пуста
+        ids, parts = self._batch()
+        if not ids:
+            return False
+        text = self.render(parts)
+        parse_mode = "Markdown"
+        failures = 0
+        delivered = True
+        while True:
+            wait = self._last_sent + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                await bot.send_message(self.chat_id, text, parse_mode=parse_mode)
+                break
+            except RetryAfter as e:
+                self.stats["retry_after"] += 1
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            except BadRequest:
+                if parse_mode:
+                    # Скорее всего разметку сломали данные пациента (например, "_" в имени)
+                    parse_mode = None
+                    continue
+                logger.exception("Telegram отклонил уведомление врачам, пропускаем: %s", text[:200])
+                delivered = False
+                break
+            except (Forbidden, TimedOut, NetworkError) as e:
+                # Бота убрали из группы или нет сети — уведомления ждут в очереди
+                failures += 1
+                self.stats["errors"] += 1
+                delay = min(self.max_backoff, 2 ** failures)
+                logger.warning("Не удалось отправить уведомление врачам (%s), повтор через %s с", e, delay)
+            await asyncio.sleep(delay)
+        self._last_sent = time.monotonic()
+        self._db.executemany("DELETE FROM notifications WHERE id = ?", [(i,) for i in ids])
+        if delivered:
+            self.stats["sent"] += len(ids)
+            self.stats["digests"] += 1
+        else:
+            self.stats["dropped"] += len(ids)
+        return True
+
+    def metrics(self):
+        return dict(self.stats, pending=self.pending, window=self.window)
+
+    def close(self):
+        self._db.close()
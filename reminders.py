@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from telegram.error import Forbidden, BadRequest, RetryAfter, TimedOut, NetworkError, TelegramError
+
+logger = logging.getLogger("dataklinik")
+
+
+class TokenBucket:
+    # rate токенов в секунду, не больше capacity подряд
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ReminderDispatcher:
+    # Напоминания о записях за offsets_hours часов до приёма. Записи берутся из индекса
+    # BookingStore по датам, отправка идёт параллельно под общим лимитом Telegram
+    # (rate сообщений в секунду) и не чаще раза в per_chat_interval секунд в один чат.
+    # Отправленные напоминания запоминаются в SQLite, поэтому рестарт или повторный
+    # запуск задачи не приводит к дублям.
+
+    def __init__(self, store, db_path, offsets_hours=(24, 2), rate=25, per_chat_interval=1.0,
+                 concurrency=10, retries=3):
+        self.store = store
+        self.offsets = sorted(offsets_hours)
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.concurrency = concurrency
+        self.retries = retries
+        self._chat_locks = {}
+        self._chat_last = {}
+        self._running = asyncio.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS reminders_sent (key TEXT PRIMARY KEY, sent_at REAL NOT NULL)"
+        )
+        self.stats = {"runs": 0, "sent": 0, "failed": 0, "retried": 0, "blocked": 0, "skipped": 0}
+
+    @staticmethod
+    def _key(rec, chat_id, offset):
+        return f"{chat_id}|{rec.get('Дата')}|{rec.get('Время')}|{rec.get('Услуга')}|{offset}"
+
+    def _is_sent(self, key):
+        return self._db.execute("SELECT 1 FROM reminders_sent WHERE key = ?", (key,)).fetchone() is not None
+
+    def _mark_sent(self, keys):
+        now = time.time()
+        self._db.executemany(
+            "INSERT OR IGNORE INTO reminders_sent (key, sent_at) VALUES (?, ?)", [(k, now) for k in keys]
+        )
+
+    @staticmethod
+    def _created(rec):
+        # "Создано" пишет бот (см. register_and_notify); у строк администраторов его может не быть
+        try:
+            return datetime.strptime(str(rec.get("Создано", "")).strip(), "%d.%m.%Y %H:%M")
+        except ValueError:
+            return None
+
+    def due(self, now=None):
+        # [(chat_id, запись, время приёма, ключи)] — для каждой записи одно напоминание,
+        # даже если бот пропустил несколько сроков (например, был выключен). Срок, который
+        # прошёл ещё до создания записи (запись на завтра, сделанная вечером), не пропущен —
+        # такие ключи сразу отмечаются отправленными
+        now = now or datetime.now()
+        horizon = max(self.offsets)
+        result = []
+        for day in range(horizon // 24 + 2):
+            date = (now + timedelta(days=day)).strftime("%d.%m.%Y")
+            for rec in self.store.on_date(date):
+                chat_id = str(rec.get(self.store.chat_key, "")).strip()
+                try:
+                    at = datetime.strptime(f"{date} {str(rec.get('Время', '')).strip()}", "%d.%m.%Y %H:%M")
+                except ValueError:
+                    continue
+                if not chat_id or at <= now:
+                    continue
+                created = self._created(rec)
+                keys, skipped = [], []
+                for off in self.offsets:
+                    threshold = at - timedelta(hours=off)
+                    if threshold > now:
+                        continue
+                    key = self._key(rec, chat_id, off)
+                    (skipped if created and threshold < created else keys).append(key)
+                skipped = [k for k in skipped if not self._is_sent(k)]
+                if skipped:
+                    self.stats["skipped"] += len(skipped)
+                    self._mark_sent(skipped)
+                if keys and not all(self._is_sent(k) for k in keys):
+                    result.append((chat_id, rec, at, keys))
+        return result
+
+    @staticmethod
+    def render(rec, at, now):
+        if at.date() == now.date():
+            when = "сегодня"
+        elif at.date() == (now + timedelta(days=1)).date():
+            when = "завтра"
+        else:
+            when = at.strftime("%d.%m.%Y")
+        return f"🔔 Напоминание: у вас {when} запись на *{rec.get('Услуга')}* в *{rec.get('Время')}*."
+
+    async def run(self, bot):
+        if self._running.locked():
+            return 0
+        async with self._running:
+            self.stats["runs"] += 1
+            now = datetime.now()
+            jobs = self.due(now)
+            sem = asyncio.Semaphore(self.concurrency)
+
+            async def one(chat_id, rec, at, keys):
+                async with sem:
+                    if await self._send(bot, chat_id, self.render(rec, at, now)):
+                        self._mark_sent(keys)
+
+            # Ошибка одной отправки не должна обрывать остальные
+            results = await asyncio.gather(*(one(*job) for job in jobs), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    self.stats["failed"] += 1
+                    logger.error("Не удалось отправить напоминание", exc_info=result)
+            self._chat_locks.clear()
+            self._chat_last.clear()
+            self._db.execute("DELETE FROM reminders_sent WHERE sent_at < ?", (time.time() - 14 * 86400,))
+            return len(jobs)
+
+    async def _send(self, bot, chat_id, text):
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            for attempt in range(self.retries + 1):
+                wait = self._chat_last.get(chat_id, 0) + self.per_chat_interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                await self.bucket.acquire()
+                try:
+                    await bot.send_message(chat_id, text, parse_mode="Markdown")
+                    self._chat_last[chat_id] = time.monotonic()
+                    self.stats["sent"] += 1
+                    return True
+                except RetryAfter as e:
+                    delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                except (Forbidden, BadRequest):
+                    # Пациент заблокировал бота или чат не существует — повторять бессмысленно
+                    self.stats["blocked"] += 1
+                    return True
+                except (TimedOut, NetworkError):
+                    delay = 2 ** attempt
+                except TelegramError as e:
+                    # Прочие ошибки Telegram (например, ChatMigrated) повтором не исправить
+                    logger.warning("Напоминание в чат %s не отправлено: %s", chat_id, e)
+                    break
+                if attempt < self.retries:
+                    self.stats["retried"] += 1
+                    await asyncio.sleep(delay)
+            self.stats["failed"] += 1
+            return False
+
+    def metrics(self):
+        return dict(self.stats, offsets_hours=self.offsets)
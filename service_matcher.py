@@ -0,0 +1,72 @@
+from collections import deque
+
+
+class ServiceMatcher:
+    # Автомат Ахо–Корасик по названиям и ключевым словам всех услуг: строится один раз
+    # при загрузке services.json и находит все вхождения за один проход по тексту.
+
+    def __init__(self, services_dict):
+        self.services = list(services_dict.values())
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]   # узел -> [(длина паттерна, индекс услуги)]
+        for idx, s in enumerate(self.services):
+            patterns = [s["название"]] + list(s.get("ключи", []))
+            for p in patterns:
+                p = p.strip().lower()
+                if p:
+                    self._add(p, idx)
+        self._build()
+
+    def _add(self, pattern, idx):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        if (len(pattern), idx) not in self._out[node]:
+            self._out[node].append((len(pattern), idx))
+
+    def _build(self):
+        # Дети корня ссылаются на корень; остальные — на самый длинный собственный суффикс
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_all(self, text):
+        # Все вхождения: [(позиция начала, длина, индекс услуги)]
+        hits = []
+        node = 0
+        for pos, ch in enumerate(text.lower()):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, idx in self._out[node]:
+                hits.append((pos - length + 1, length, idx))
+        return hits
+
+    def rank(self, text):
+        # Кандидаты по убыванию специфичности: самое длинное совпадение, затем число совпадений,
+        # затем более раннее упоминание
+        best = {}
+        for start, length, idx in self.find_all(text):
+            longest, count, first = best.get(idx, (0, 0, start))
+            best[idx] = (max(longest, length), count + 1, min(first, start))
+        order = sorted(best.items(), key=lambda kv: (-kv[1][0], -kv[1][1], kv[1][2], kv[0]))
+        return [self.services[idx]["название"] for idx, _ in order]
+
+    def best(self, text):
+        ranked = self.rank(text)
+        return ranked[0] if ranked else None
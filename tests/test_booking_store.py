@@ -0,0 +1,60 @@
+# Точечное обновление индексов BookingStore против полного перестроения
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from booking_store import DEFAULT_HEADER, BookingStore  # noqa: E402
+
+SERVICES = ["Чистка зубов", "Рентген", "Консультация"]
+TIMES = ["10:00", "11:00", "12:00"]
+
+
+def make_row(i):
+    return [f"П{i}", "+77001112233", SERVICES[i % 3], f"{i % 5 + 1:02d}.10.2026",
+            TIMES[i % 3], str(i % 7), str(i)]
+
+
+def snapshot(store):
+    store.find([])   # индекс по identity строится лениво
+    rows = {id(r): i for i, r in enumerate(store.records)}
+    return (
+        {k: +c for k, c in store._slots.items() if +c},
+        {k: [rows[id(r)] for r in v] for k, v in store._by_chat.items() if v},
+        {k: [rows[id(r)] for r in v] for k, v in store._by_date.items() if v},
+        {k: [rows[id(r)] for r in v] for k, v in store._by_identity.items() if v},
+        [store.row_of(r) for r in store.records],
+    )
+
+
+def test_incremental_indexes_match_rebuild():
+    rnd = random.Random(1)
+    store = BookingStore(None)
+    store.load([DEFAULT_HEADER] + [make_row(i) for i in range(50)])
+    n = 50
+    for _ in range(500):
+        live = [r for r in store.records if not r.get("_deleted")]
+        action = rnd.choice(["append", "pending", "delete", "time", "date", "remove", "extend"])
+        if action in ("append", "pending"):
+            store.append(make_row(n), pending=action == "pending")
+            n += 1
+        elif action == "extend":
+            store.extend([make_row(n), make_row(n + 1)])
+            n += 2
+        elif action == "delete" and live:
+            store.mark_deleted(rnd.choice(live))
+        elif action == "time" and live:
+            store.set_field(rnd.choice(live), "Время", rnd.choice(TIMES))
+        elif action == "date" and live:
+            store.set_field(rnd.choice(live), "Дата", f"{rnd.randint(1, 5):02d}.10.2026")
+        elif action == "remove" and store.records:
+            store.remove(rnd.sample(store.records, min(3, len(store.records))))
+        incremental = snapshot(store)
+        store._reindex()
+        assert snapshot(store) == incremental
+        rec = rnd.choice(store.records) if store.records else None
+        if rec is not None and not rec.get("_deleted"):
+            assert store.resolve(rec) is rec
+            assert store.find(store.identity(rec)) is not None
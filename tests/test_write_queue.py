@@ -0,0 +1,122 @@
+# Очередь записи против листа, который параллельно правят администраторы.
+# Запуск из корня репозитория:  python -m pytest -q tests
+import asyncio
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fakes import FakeSheet  # noqa: E402
+from blocking_io import BlockingPool  # noqa: E402
+from booking_store import BookingStore  # noqa: E402
+from write_queue import SheetWriteQueue  # noqa: E402
+
+
+def make_row(name, chat_id):
+    return [name, "+77001112233", "Чистка зубов", "20.10.2026", "10:00", str(chat_id), "seed"]
+
+
+def names(sheet):
+    return [r[0] for r in sheet.rows[1:]]
+
+
+def make_queue(tmp_path, names_):
+    sheet = FakeSheet(rows=[make_row(n, i) for i, n in enumerate(names_)])
+    store = BookingStore(sheet)
+    queue = SheetWriteQueue(sheet, store, BlockingPool(1, name="test"), str(tmp_path / "journal.jsonl"))
+    asyncio.run(queue.refresh())
+    return sheet, store, queue
+
+
+def test_delete_after_staff_deleted_row_above(tmp_path):
+    sheet, store, queue = make_queue(tmp_path, "ABCD")
+    del sheet.rows[2]   # администратор удалил B
+    _, rec = store.last_booking("2")
+    assert queue.delete(rec)
+    asyncio.run(queue.flush())
+    assert names(sheet) == ["A", "D"]
+    assert queue.stats["row_mismatches"] == 1
+    assert queue.pending == 0
+
+
+def test_update_after_staff_appended_row(tmp_path):
+    sheet, store, queue = make_queue(tmp_path, "ABCD")
+    sheet.rows.append(make_row("S", 99))   # строку дописал администратор
+    queue.append(make_row("E", 4))
+    asyncio.run(queue.flush())
+    _, rec = store.last_booking("4")
+    assert queue.update(rec, "Время", "12:00")
+    asyncio.run(queue.flush())
+    assert names(sheet) == ["A", "B", "C", "D", "S", "E"]
+    assert sheet.rows[5][4] == "10:00"
+    assert sheet.rows[6][4] == "12:00"
+    assert queue.stats["row_mismatches"] == 1
+
+
+def test_refresh_after_rows_shifted(tmp_path):
+    sheet, store, queue = make_queue(tmp_path, "ABCD")
+    del sheet.rows[1]   # администратор удалил A
+    _, rec = store.last_booking("2")
+    assert queue.delete(rec)
+    assert asyncio.run(queue.sync()) is None
+    asyncio.run(queue.refresh())
+    assert names(sheet) == ["B", "D"]
+    assert queue.pending == 0
+    assert [r["Имя"] for r in store.records] == ["B", "D"]
+
+
+def test_restart_keeps_journal(tmp_path):
+    sheet, store, queue = make_queue(tmp_path, "ABC")
+    _, rec = store.last_booking("1")
+    queue.delete(rec)
+    # После рестарта warm_up сначала перечитывает лист, потом применяет журнал
+    restarted = SheetWriteQueue(sheet, BookingStore(sheet), BlockingPool(1, name="test"), queue.journal_path)
+    asyncio.run(restarted.refresh())
+    assert restarted.replay() == 1
+    asyncio.run(restarted.flush())
+    assert names(sheet) == ["A", "C"]
+
+
+def test_replay_skips_append_already_in_sheet(tmp_path):
+    sheet, _, queue = make_queue(tmp_path, "AB")
+    queue.append(make_row("E", 4))
+    queue.append(make_row("F", 5))
+    # Процесс упал после append_rows, но до перезаписи журнала: E уже в листе, F — нет
+    sheet.rows.append(make_row("E", 4))
+    restarted = SheetWriteQueue(sheet, BookingStore(sheet), BlockingPool(1, name="test"), queue.journal_path)
+    asyncio.run(restarted.refresh())
+    assert restarted.replay() == 1
+    asyncio.run(restarted.flush())
+    assert names(sheet) == ["A", "B", "E", "F"]
+
+
+def test_cancel_pending_booking_during_flush(tmp_path):
+    sheet, store, queue = make_queue(tmp_path, "AB")
+    sheet.latency = 0.05
+    _, a = store.last_booking("0")
+    queue.update(a, "Время", "12:00")
+    rec = queue.append(make_row("E", 4))
+
+    async def scenario():
+        flush = asyncio.ensure_future(queue.flush())
+        await asyncio.sleep(0.01)   # flush сверяет строки и отправляет правку
+        assert queue.delete(rec)
+        await flush
+
+    asyncio.run(scenario())
+    assert names(sheet) == ["A", "B"]
+    assert [r["Имя"] for r in store.records] == ["A", "B"]
+    assert queue.pending == 0
+
+
+def test_reschedule_pending_booking_survives_restart(tmp_path):
+    sheet, _, queue = make_queue(tmp_path, "AB")
+    rec = queue.append(make_row("E", 4))
+    assert queue.update(rec, "Время", "12:00")
+    restarted = SheetWriteQueue(sheet, BookingStore(sheet), BlockingPool(1, name="test"), queue.journal_path)
+    asyncio.run(restarted.refresh())
+    assert restarted.replay() == 1
+    asyncio.run(restarted.flush())
+    assert names(sheet) == ["A", "B", "E"]
+    assert sheet.rows[3][4] == "12:00"
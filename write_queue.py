@@ -0,0 +1,320 @@
+import asyncio
+import json
+import os
+import time
+
+
+def column_letter(n):
+    # 1 -> A, 27 -> AA
+    letters = ""
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+class SheetWriteQueue:
+    # Отложенная запись в лист: пациент получает ответ сразу, изменение применяется к
+    # локальному BookingStore и записывается в журнал на диске, а в Google Sheets уходит
+    # пачкой раз в flush_interval секунд: batch_update для правок ячеек, один batch_update
+    # со всеми deleteDimension (от нижних строк к верхним) и append_rows для новых записей.
+    #
+    # Номера строк вычисляются только в момент отправки, по текущему положению записи
+    # в store, поэтому параллельные отмены не сдвигают друг другу строки. Администраторы
+    # правят лист вручную, поэтому перед правками и удалениями целевые строки читаются одним
+    # batch_get и сверяются с записями; если лист сдвинулся, он перечитывается целиком, и
+    # изменения из очереди заново находят свои строки по identity.
+
+    def __init__(self, sheet, store, pool, journal_path, flush_interval=2.0, max_batch=100,
+                 max_backoff=60.0):
+        self.sheet = sheet
+        self.store = store
+        self.pool = pool
+        self.journal_path = journal_path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_backoff = max_backoff
+        self.ops = []
+        self._lock = asyncio.Lock()
+        self._failures = 0
+        self._retry_at = 0.0
+        self.stats = {
+            "flushes": 0,
+            "flush_errors": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_flush_seconds": 0.0,
+            "last_flush_at": None,
+            "syncs": 0,
+            "sync_rows": 0,
+            "sync_fallbacks": 0,
+            "last_sync_seconds": 0.0,
+            "full_reloads": 0,
+            "row_mismatches": 0,
+        }
+
+    # --- Постановка в очередь ---
+    def append(self, row):
+        rec = self.store.append(row, pending=True)
+        self._push({"op": "append", "rec": rec})
+        return rec
+
+    def delete(self, rec):
+        rec = self.store.resolve(rec)
+        if rec is None:
+            return False
+        if rec.get("_pending"):
+            # Запись ещё не дошла до листа — просто не отправляем её
+            self.ops = [op for op in self.ops if op["rec"] is not rec]
+            self.store.remove([rec])
+            self._write_journal()
+            return True
+        identity = self.store.identity(rec)
+        self.store.mark_deleted(rec)
+        self._push({"op": "delete", "rec": rec, "identity": identity})
+        return True
+
+    def update(self, rec, field, value):
+        rec = self.store.resolve(rec)
+        if rec is None:
+            return False
+        self.store.set_field(rec, field, value)
+        if rec.get("_pending"):
+            # Для ещё не отправленной записи новое значение уйдёт вместе с append — в журнале
+            # её строка тоже должна быть уже с ним
+            self._write_journal()
+        else:
+            self._push({"op": "update", "rec": rec, "field": field,
+                        "identity": self.store.identity(rec)})
+        return True
+
+    def _push(self, op):
+        self.ops.append(op)
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self._dump(op), ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    # --- Журнал ---
+    def _dump(self, op):
+        if op["op"] == "append":
+            return {"op": "append", "row": self.store.row_values(op["rec"])}
+        if op["op"] == "delete":
+            return {"op": "delete", "identity": op["identity"]}
+        return {"op": "update", "identity": op["identity"], "field": op["field"],
+                "value": op["rec"].get(op["field"], "")}
+
+    def _write_journal(self):
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for op in self.ops:
+                f.write(json.dumps(self._dump(op), ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.journal_path)
+
+    def replay(self):
+        # Вызывать после загрузки store: восстанавливает неотправленные изменения после рестарта
+        if not os.path.exists(self.journal_path):
+            return 0
+        entries = []
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        self.ops = []
+        for e in entries:
+            if e["op"] == "append":
+                # append_rows мог пройти, а журнал не успел переписаться — строка уже в листе
+                if self.store.find(self.store.row_identity(e["row"])) is None:
+                    self.append(e["row"])
+                continue
+            # Строки, которых уже нет в листе, считаем применёнными
+            rec = self.store.find(e["identity"])
+            if rec is None:
+                continue
+            if e["op"] == "delete":
+                self.delete(rec)
+            else:
+                self.update(rec, e["field"], e["value"])
+        self._write_journal()
+        return len(self.ops)
+
+    # --- Отправка ---
+    @property
+    def pending(self):
+        return len(self.ops)
+
+    async def flush(self):
+        if not self.ops or time.monotonic() < self._retry_at:
+            return 0
+        async with self._lock:
+            return await self._flush_locked()
+
+    async def _flush_locked(self):
+        batch = self.ops[:self.max_batch]
+        if not batch:
+            return 0
+        started = time.monotonic()
+        try:
+            if not await self._rows_match(batch):
+                self.stats["row_mismatches"] += 1
+                await self._reload_locked()
+                batch = self.ops[:self.max_batch]
+                if not await self._rows_match(batch):
+                    raise RuntimeError("Строки листа сдвинулись во время записи")
+            await self._send_updates([op for op in batch if op["op"] == "update"])
+            await self._send_deletes([op for op in batch if op["op"] == "delete"])
+            await self._send_appends([op for op in batch if op["op"] == "append"])
+        except Exception:
+            self._failures += 1
+            self.stats["flush_errors"] += 1
+            self._retry_at = time.monotonic() + min(self.max_backoff, 2 ** self._failures)
+            raise
+        finally:
+            self._write_journal()
+        self._failures = 0
+        self._retry_at = 0.0
+        self.stats["flushes"] += 1
+        self.stats["last_batch_size"] = len(batch)
+        self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
+        self.stats["last_flush_seconds"] = time.monotonic() - started
+        self.stats["last_flush_at"] = time.time()
+        return len(batch)
+
+    async def _rows_match(self, batch):
+        # Стоят ли записи, которые будем править и удалять, на тех строках листа, где их ждёт store
+        recs = [op["rec"] for op in batch if op["op"] != "append"]
+        if not recs:
+            return True
+        rows = [self.store.row_of(rec) for rec in recs]
+        if None in rows:
+            return False
+        last = column_letter(len(self.store.header))
+        values = await self.pool.run(self.sheet.batch_get, [f"A{row}:{last}{row}" for row in rows])
+        return all(self.store.matches(rec, found[0] if found else [])
+                   for rec, found in zip(recs, values))
+
+    async def _reload_locked(self):
+        values = await self.pool.run(self.sheet.get_all_values)
+        self.store.load(values)
+        self.stats["full_reloads"] += 1
+        self._remap()
+
+    def _remap(self):
+        # После перечитывания листа в store только то, что в нём есть: неотправленные записи
+        # дописываем заново, удаления и правки привязываем к строкам по identity из журнала.
+        # Пустую очередь не трогаем: при старте refresh идёт до replay, журнал ещё не прочитан
+        if not self.ops:
+            return
+        ops = []
+        for op in self.ops:
+            if op["op"] == "append":
+                op["rec"] = self.store.append(self.store.row_values(op["rec"]), pending=True)
+            else:
+                rec = self.store.find(op["identity"])
+                if rec is None:
+                    # Строки уже нет в листе — считаем изменение применённым
+                    continue
+                if op["op"] == "delete":
+                    self.store.mark_deleted(rec)
+                else:
+                    self.store.set_field(rec, op["field"], op["rec"].get(op["field"], ""))
+                op["rec"] = rec
+            ops.append(op)
+        self.ops = ops
+        self._write_journal()
+
+    def _done(self, sent):
+        sent = {id(op) for op in sent}
+        self.ops = [op for op in self.ops if id(op) not in sent]
+
+    async def _send_updates(self, ops):
+        data = []
+        for op in ops:
+            rec, field = op["rec"], op["field"]
+            row = self.store.row_of(rec)
+            if rec.get("_deleted") or row is None or field not in self.store.header:
+                continue
+            col = self.store.header.index(field) + 1
+            data.append({"range": f"{column_letter(col)}{row}", "values": [[rec.get(field, "")]]})
+        if data:
+            await self.pool.run(self.sheet.batch_update, data)
+        self._done(ops)
+
+    async def _send_deletes(self, ops):
+        rows = sorted({self.store.row_of(op["rec"]) for op in ops} - {None}, reverse=True)
+        requests = [{
+            "deleteDimension": {
+                "range": {"sheetId": self.sheet.id, "dimension": "ROWS",
+                          "startIndex": row - 1, "endIndex": row},
+            }
+        } for row in rows]
+        if requests:
+            await self.pool.run(self.sheet.spreadsheet.batch_update, {"requests": requests})
+        self.store.remove([op["rec"] for op in ops])
+        self._done(ops)
+
+    async def _send_appends(self, ops):
+        # Пока шли правки и удаления, пациент мог отменить ещё не отправленную запись —
+        # delete() убрал её из очереди, и отправлять её уже нельзя
+        live = {id(op) for op in self.ops}
+        ops = [op for op in ops if id(op) in live]
+        recs = [op["rec"] for op in ops]
+        if not recs:
+            return
+        # Пока строки летят в лист, отмена должна удалять их из листа, а не из очереди
+        for rec in recs:
+            rec.pop("_pending", None)
+        try:
+            await self.pool.run(self.sheet.append_rows, [self.store.row_values(r) for r in recs])
+        except Exception:
+            for rec in recs:
+                rec["_pending"] = True
+            raise
+        self._done(ops)
+
+    async def refresh(self):
+        # Полное перечитывание листа. Сначала читаем лист, потом отправляем очередь: refresh
+        # вызывают, когда строки листа сдвинулись, и номера строк из store уже неверны.
+        # Неотправленные изменения после загрузки заново находят свои строки (_remap)
+        async with self._lock:
+            await self._reload_locked()
+            if self.ops and time.monotonic() >= self._retry_at:
+                await self._flush_locked()
+            return True
+
+    async def sync(self):
+        # Дельта-синхронизация: читаем только хвост листа, начиная с последней известной строки.
+        # Эта строка — якорь: если она изменилась или пропала, строки выше неё удалены или
+        # вставлены, и нужен полный refresh (тогда возвращаем None). Иначе всё, что ниже якоря,
+        # дописано в лист не ботом — добавляем в store и возвращаем число таких строк.
+        # Правки ячеек в середине листа так не видны — их подхватывает периодический refresh.
+        if self.store.loaded_at is None:
+            return None
+        async with self._lock:
+            started = time.monotonic()
+            known = self.store.synced_count()
+            anchor = self.store.records[known - 1] if known else None
+            # Строка листа записи i — i + 2; якорь (запись known - 1) — строка known + 1
+            first = known + 1 if known else 2
+            values = await self.pool.run(self.sheet.get, f"A{first}:{column_letter(len(self.store.header))}")
+            values = list(values or [])
+            if anchor is not None:
+                if not values or not self.store.matches(anchor, values[0]):
+                    self.stats["sync_fallbacks"] += 1
+                    return None
+                values = values[1:]
+            added = self.store.extend(values) if values else 0
+            self.stats["syncs"] += 1
+            self.stats["sync_rows"] += added
+            self.stats["last_sync_seconds"] = time.monotonic() - started
+            return added
+
+    def metrics(self):
+        return dict(self.stats, pending=self.pending, flush_interval=self.flush_interval,
+                    max_batch=self.max_batch)